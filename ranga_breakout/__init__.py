@@ -10,11 +10,13 @@ O_UTIL = Utilities()
 
 
 S_DUMP = S_DATA + "symbols.json"
+S_SYMS = S_DATA + "symbols/"
 S_UNIV = S_DATA + "universe.csv"
 S_CASH = S_DATA + "cash.csv"
 S_FUTURE = S_DATA + "future.csv"
 S_OUT = S_DATA + "out.csv"
 S_STOPS = S_DATA + "stops.json"
+S_ACTIONS = S_DATA + "actions.jsonl"
 YML = O_FUTL.get_lst_fm_yml("../../breakout.yml")
 CNFG = YML["angelone"]
 pprint(YML)
@@ -22,3 +24,13 @@ pprint(YML)
 O_SETG = O_FUTL.get_lst_fm_yml(S_DATA + "settings.yml")
 pprint(YML)
 SFX = "FUT"
+# exchange time, and when the cash session opens in it
+TZ = "Asia/Kolkata"
+SESSION_OPEN = "9:15"
+
+
+def json_default(value):
+    # numpy scalars from the candle helpers, anything else as text
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
@@ -1,10 +1,45 @@
 from omspy_brokers.angel_one import AngelOne
-from __init__ import logging, CNFG
+from __init__ import logging, CNFG, O_SETG, YML
+from ratelimit import Scheduler
+from journal import O_JOURNAL
+from latency import timed
 from traceback import print_exc
 from pprint import pprint
 
+# requests per second allowed by angel one for each endpoint
+LIMITS = {
+    "order_place": 20,
+    "order_modify": 20,
+    "order_cancel": 20,
+    "orders": 1,
+    "positions": 1,
+    "ltp": 10,
+    "candle": 3,
+}
+# when calls are queued, lower number is dispatched first
+PRIORITY = {
+    "order_place": 0,
+    "order_modify": 0,
+    "order_cancel": 0,
+    "orders": 1,
+    "positions": 1,
+    "ltp": 2,
+    "candle": 3,
+}
+
 
 def get_token():
+    if YML.get("broker", "angelone") == "paper":
+        # simulated fills on the wall clock, see paper.py
+        from paper import PaperBroker
+
+        # there is no session for the websockets to log in with, they
+        # would only reconnect forever in their threads
+        streams = [k for k in ["feed", "order_feed"] if O_SETG.get(k, False)]
+        if any(streams):
+            raise ValueError(f"paper broker cannot stream, turn off {streams}")
+        logging.info("paper trading")
+        return PaperBroker.from_config(YML.get("paper", {}))
     ao = AngelOne(**CNFG)
     if ao.authenticate():
         logging.info("api connected")
@@ -15,6 +50,13 @@ def get_token():
 
 class Helper:
     ao = None
+    scheduler = Scheduler(LIMITS, PRIORITY)
+    journal = O_JOURNAL
+
+    @classmethod
+    def _timed(cls, endpoint, fn):
+        """the broker round trip alone, without the wait for a token"""
+        return timed(f"broker.{endpoint}")(fn)
 
     @classmethod
     @property
@@ -25,11 +67,14 @@ class Helper:
 
     @classmethod
     @property
+    @timed("api.Helper.orders")
     def orders(cls):
         try:
             resp = []
             # get orders
-            resp = cls.ao.orders
+            resp = cls.scheduler.call(
+                "orders", cls._timed("orders", lambda: cls.ao.orders)
+            )
             resp = resp["data"]
             return resp
         except Exception as e:
@@ -41,12 +86,51 @@ class Helper:
     def positions(cls):
         try:
             # get orders
-            resp = cls.ao.positions
+            resp = cls.scheduler.call(
+                "positions", cls._timed("positions", lambda: cls.ao.positions)
+            )
             return resp["data"]
         except Exception as e:
             logging.error(f"{e} while api is getting positions")
             return []
 
+    @classmethod
+    def submit(cls, endpoint, **kwargs):
+        """
+        queue an order_place, order_modify or order_cancel without
+        waiting, returns a future of the broker response
+        """
+        seq = cls.journal.request(endpoint, kwargs)
+        fn = cls._timed(endpoint, getattr(cls.api, endpoint))
+        future = cls.scheduler.submit(endpoint, fn, **kwargs)
+        future.add_done_callback(lambda done: cls.journal.response(seq, done))
+        return future
+
+    @classmethod
+    def order_place(cls, **kwargs):
+        return cls.submit("order_place", **kwargs).result()
+
+    @classmethod
+    def order_modify(cls, **kwargs):
+        return cls.submit("order_modify", **kwargs).result()
+
+    @classmethod
+    def order_cancel(cls, **kwargs):
+        return cls.submit("order_cancel", **kwargs).result()
+
+    @classmethod
+    def candle_data(cls, historic_param):
+        fn = cls._timed("candle", cls.api.obj.getCandleData)
+        return cls.scheduler.call("candle", fn, historic_param)
+
+    @classmethod
+    def market_data(cls, mode, exch_token_dict):
+        fn = cls._timed("ltp", cls.api.obj.getMarketData)
+        return cls.scheduler.call("ltp", fn, mode, exch_token_dict)
+
+    @classmethod
+    def stats(cls):
+        return cls.scheduler.stats()
 
 if __name__ == "__main__":
     from __init__ import CNFG, S_DATA
@@ -100,7 +184,7 @@ if __name__ == "__main__":
                 "trigger_price": 4351.5,
                 "orderid": "241127000230561",
             }
-            resp = Helper.api.order_modify(**params)
+            resp = Helper.order_modify(**params)
             print(resp)
         except Exception as e:
             print(e)
@@ -108,3 +192,4 @@ if __name__ == "__main__":
 
     orders()
     positions()
+    pprint(Helper.stats())
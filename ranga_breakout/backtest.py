@@ -0,0 +1,196 @@
+from traceback import print_exc
+from contextlib import redirect_stdout
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pendulum as pdlm
+
+from __init__ import logging, SESSION_OPEN, TZ
+from api import Helper, LIMITS, PRIORITY
+from ratelimit import Inline
+from journal import OrderJournal
+from orderbook import OrderBook
+from candles import O_CANDLES, MINUTES, BarBuilder, candle_interval
+from history import Candles, get_candles
+from bulk import place_initial_orders
+from exit_and_go import flatten
+from simbroker import SimBroker, random_day, tick_path
+
+
+def _at(day, hh_mm: str) -> int:
+    hour, minute = [int(x) for x in hh_mm.split(":")]
+    return day.replace(hour=hour, minute=minute, second=0).int_timestamp
+
+
+def _minute_matrix(minutes: dict, tokens: list, day_open: int, n: int):
+    """o, h, l, c as (tokens x minutes of the day), nan when nothing traded"""
+    ohlc = np.full((4, len(tokens), n), np.nan)
+    for row, token in enumerate(tokens):
+        candles = Candles.from_rows(minutes.get(token, []))
+        col = (candles.ts - day_open) // 60
+        ok = (col >= 0) & (col < n)
+        for i, values in enumerate([candles.o, candles.h, candles.l, candles.c]):
+            ohlc[i, row, col[ok]] = values[ok]
+    return ohlc
+
+
+class Backtest:
+    """
+    one trading day of the unmodified strategy classes against
+    SimBroker. every 1 minute bar is stepped through as ticks, then the
+    clock moves to its close and every live strategy runs once, as the
+    engine would run them when the feeds are polled.
+
+    minutes: 1 minute broker candles (rows or Candles) of the day by token
+    universe: DataFrame like stocks_in_play with symbol, exchange,
+        token and quantity
+    make: builds a strategy from one of the params, e.g. Reverse
+    get_params: get_candles or get_candles_ranked, called at `start`
+    """
+
+    def __init__(
+        self,
+        minutes: dict,
+        universe: pd.DataFrame,
+        make,
+        get_params=get_candles,
+        start="9:45",
+        stop="15:20",
+        interval=None,
+    ):
+        self.minutes = minutes
+        self.universe = universe
+        self.make = make
+        self.get_params = get_params
+        self.start = start
+        self.stop = stop
+        self.interval = interval or candle_interval()
+        self.broker = SimBroker(minutes)
+        # bars come from the ticks, as when the live feed is on
+        self.builder = BarBuilder(MINUTES[self.interval], SESSION_OPEN)
+        self.book = OrderBook()
+        self.strategies = []
+        self.runs = 0
+        self._saved = None
+        self._saved_pprint = None
+
+    def _plug(self):
+        """route Helper to the simulated broker, without rate limits"""
+        self._saved = (Helper.ao, Helper.scheduler, Helper.journal)
+        Helper.ao = self.broker
+        Helper.scheduler = Inline(LIMITS, PRIORITY)
+        Helper.journal = OrderJournal(path=None)
+        O_CANDLES.clear()
+        O_CANDLES.builders.clear()
+        O_CANDLES.attach(self.interval, self.builder)
+
+    def _unplug(self):
+        pdlm.travel_back()
+        O_CANDLES.builders.clear()
+        Helper.ao, Helper.scheduler, Helper.journal = self._saved
+        if self._saved_pprint is not None:
+            module, fn = self._saved_pprint
+            module.pprint = fn
+
+    def _clock(self, epoch: int):
+        self.broker.now = epoch
+        pdlm.travel_to(pdlm.from_timestamp(epoch, tz=TZ), freeze=True)
+
+    def _quiet(self):
+        """strategies pprint their state on every run, too slow for a replay"""
+        for obj in self.strategies[:1]:
+            module = sys.modules[obj.__class__.__module__]
+            if hasattr(module, "pprint"):
+                self._saved_pprint = (module, module.pprint)
+                module.pprint = lambda *args, **kwargs: None
+
+    def _begin(self):
+        params = self.get_params(self.universe, self.start)
+        self.strategies = [self.make(param) for param in params.values()]
+        self._quiet()
+        place_initial_orders(self.strategies)
+
+    def _run_all(self):
+        self.book.update(self.broker.orders["data"])
+        candle_other = 2
+        for obj in self.strategies:
+            if obj.dct["fn"] is not None:
+                obj.run(self.book, self.broker.ltp, candle_other)
+                candle_other = obj.candle_count
+                self.runs += 1
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        try:
+            self._plug()
+            tokens = [str(t) for t in self.universe["token"]]
+            first = min(
+                int(candles.ts[0])
+                for candles in self.broker.minutes.values()
+                if len(candles) > 0
+            )
+            day = pdlm.from_timestamp(first, tz=TZ)
+            day_open = _at(day, SESSION_OPEN)
+            start, stop = _at(day, self.start), _at(day, self.stop)
+            n = (stop - day_open) // 60
+            o, h, l, c = _minute_matrix(self.minutes, tokens, day_open, n)
+
+            # strategies print on every run
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                for minute in range(n):
+                    self._clock(day_open + minute * 60)
+                    at = (day_open + minute * 60) * 1000
+                    for row in np.flatnonzero(~np.isnan(c[:, minute])):
+                        path = tick_path(
+                            o[row, minute],
+                            h[row, minute],
+                            l[row, minute],
+                            c[row, minute],
+                        )
+                        for price in path:
+                            self.broker.on_tick(tokens[row], float(price))
+                            self.builder.on_tick(tokens[row], float(price), at)
+                    now = day_open + (minute + 1) * 60
+                    self._clock(now)
+                    self.builder.flush(now * 1000)
+                    if not any(self.strategies) and now >= start:
+                        self._begin()
+                    if any(self.strategies):
+                        self._run_all()
+                flatten(retries=0, settle=0)
+        except Exception as e:
+            logging.error(f"{e} while backtesting")
+            print_exc()
+        finally:
+            self._unplug()
+        pnl = self.broker.pnl()
+        return dict(
+            strategies=len(self.strategies),
+            runs=self.runs,
+            trades=len(self.broker.trades),
+            pnl=round(sum(pnl.values()), 2),
+            by_symbol=pnl,
+            seconds=round(time.perf_counter() - started, 3),
+        )
+
+
+if __name__ == "__main__":
+    from breakout import Breakout
+    from history import get_candles_ranked
+
+    tokens = [str(1000 + i) for i in range(50)]
+    universe = pd.DataFrame(
+        dict(
+            symbol=[f"SYM{t}-EQ" for t in tokens],
+            exchange="NSE",
+            token=tokens,
+            quantity=1,
+        )
+    )
+    backtest = Backtest(random_day(tokens), universe, Breakout, get_candles_ranked)
+    result = backtest.run()
+    result.pop("by_symbol")
+    print(result)
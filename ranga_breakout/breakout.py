@@ -1,12 +1,13 @@
 from traceback import print_exc
 from typing import Any  # Importing only the required types
 
-from toolkit.kokoo import dt_to_str
-
 from __init__ import logging
 from api import Helper
+from orderbook import OrderBook
 
-from history import find_buy_stop, get_historical_data, find_sell_stop
+from history import find_buy_stop, find_sell_stop
+from candles import O_CANDLES, candle_interval
+from latency import timed
 
 from pprint import pprint
 
@@ -42,7 +43,7 @@ class Breakout:
         self.dir = param["side"]
 
         defaults = {
-            "fn": self.place_second_order,
+            "fn": self.place_both_orders,
             "buy_args": {},
             "sell_args": {},
             "buy_id": None,
@@ -58,7 +59,6 @@ class Breakout:
         self.message = "message not set"
         logging.info(self.dct)
         self.make_order_params()
-        getattr(self, f"_{dir}_trade")(self.dct)
 
     def make_order_params(self):
         try:
@@ -83,7 +83,7 @@ class Breakout:
 
     def _buy_trade(self, args):
         # Place buy order
-        resp = Helper.api.order_place(**args["buy_args"])
+        resp = Helper.order_place(**args["buy_args"])
         logging.debug(
             f"{args['buy_args']['symbol']} {args['buy_args']['side']} got {resp=}"
         )
@@ -92,13 +92,32 @@ class Breakout:
 
     def _sell_trade(self, args):
         # Place sell order
-        resp = Helper.api.order_place(**args["sell_args"])
+        resp = Helper.order_place(**args["sell_args"])
         logging.debug(
             f"{args['sell_args']['symbol']} {args['sell_args']['side']} got {resp=}"
         )
         self.dct["sell_id"] = resp
         return
 
+    def legs(self):
+        """the side ranked nearer goes in first"""
+        return [self.dir, "buy" if self.dir == "sell" else "sell"]
+
+    def legs_placed(self):
+        """both orders went in through bulk.place_initial_orders"""
+        self.dct["fn"] = self.is_buy_or_sell
+        self.message = "buy and sell orders placed"
+
+    def place_both_orders(self):
+        try:
+            getattr(self, f"_{self.dir}_trade")(self.dct)
+            self.place_second_order()
+        except Exception as e:
+            self.message = f"{self.dct['tsym']} encountered {e} while placing orders"
+            logging.error(self.message)
+            print_exc()
+            self.dct["fn"] = None
+
     def place_second_order(self):
         try:
             buy_or_sell = "buy" if self.dir == "sell" else "sell"
@@ -116,6 +135,7 @@ class Breakout:
         buy_or_sell = self.dct[f"{operation}_id"]
         return self.dct_of_orders[buy_or_sell]["status"]
 
+    @timed()
     def is_buy_or_sell(self):
         # determine if buy or sell order is completed
         try:
@@ -162,14 +182,9 @@ class Breakout:
             print_exc()
 
     def get_history(self):
-        params = {
-            "exchange": self.dct["exchange"],
-            "symboltoken": self.dct["token"],
-            "interval": "FIFTEEN_MINUTE",
-            "fromdate": dt_to_str("9:15"),
-            "todate": dt_to_str(""),
-        }
-        return get_historical_data(params)
+        return O_CANDLES.get(
+            self.dct["exchange"], self.dct["token"], candle_interval()
+        )
 
     def _is_modify_order(self, candles_now):
         try:
@@ -212,6 +227,7 @@ class Breakout:
             logging.error(self.message)
             print_exc()
 
+    @timed()
     def trail_stoploss(self):
         """
         if candles  count is changed and then check ltp
@@ -259,7 +275,7 @@ class Breakout:
                     """
                     if any(args):
                         logging.debug(f"order modify {args}")
-                        resp = Helper.api.order_modify(**args)
+                        resp = Helper.order_modify(**args)
                         logging.debug(f"order modify {resp}")
                         self.candle_count = len(candles_now)
                         self.candle_other = len(candles_now)
@@ -271,12 +287,15 @@ class Breakout:
             logging.error(self.message)
             print_exc()
 
+    @timed()
     def run(self, lst_of_orders, dct_of_ltp, CANDLE_OTHER):
         try:
             if isinstance(lst_of_orders, list):
                 self.dct_of_orders = {
                     dct["orderid"]: dct for dct in lst_of_orders if "orderid" in dct
                 }
+            elif isinstance(lst_of_orders, OrderBook):
+                self.dct_of_orders = lst_of_orders.by_id
             self.dct["last_price"] = dct_of_ltp.get(
                 self.dct["token"], self.dct["last_price"]
             )
@@ -306,7 +325,7 @@ class Breakout:
 
 
 if __name__ == "__main__":
-    from main1 import get_ltp
+    from market import get_ltp
     from universe import stocks_in_play
     from history import get_candles_ranked
 
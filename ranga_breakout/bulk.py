@@ -0,0 +1,128 @@
+from traceback import print_exc
+import time
+
+from __init__ import logging
+from api import Helper
+
+
+def submit_all(endpoint: str, lst_of_kwargs: list) -> list:
+    """
+    send every request at once through the rate limited scheduler,
+    returns the response or the exception of each, in order
+    """
+    futures = [Helper.submit(endpoint, **kwargs) for kwargs in lst_of_kwargs]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logging.error(f"{e} while bulk {endpoint}")
+            results.append(e)
+    return results
+
+
+def _is_order_id(resp) -> bool:
+    return isinstance(resp, str) and len(resp) > 0
+
+
+def _places_both(obj) -> bool:
+    """
+    waits for its opening legs to be sent, strategies like Oneside
+    place their own entry when built and have nothing to wait for
+    """
+    place_both_orders = getattr(obj, "place_both_orders", None)
+    return place_both_orders is not None and obj.dct["fn"] == place_both_orders
+
+
+def place_initial_orders(strategies: list) -> dict:
+    """
+    place the opening legs of all strategies together instead of one
+    symbol after another. every strategy lists its legs in the order
+    they matter, the first legs of all symbols go out before any
+    second leg. a symbol with only one leg placed gets that leg
+    cancelled, again in bulk.
+    """
+    started = time.monotonic()
+    pending = [obj for obj in strategies if _places_both(obj)]
+    legs = []
+    for position in range(2):
+        for obj in pending:
+            sides = obj.legs()
+            if position < len(sides):
+                legs.append((obj, sides[position]))
+
+    resps = submit_all("order_place", [obj.dct[f"{side}_args"] for obj, side in legs])
+    placed = {}
+    for (obj, side), resp in zip(legs, resps):
+        logging.debug(f"{obj.dct['tsym']} {side} order response: {resp}")
+        if _is_order_id(resp):
+            obj.dct[f"{side}_id"] = resp
+            placed.setdefault(id(obj), []).append(side)
+
+    orphans = []
+    for obj in pending:
+        sides = placed.get(id(obj), [])
+        if len(sides) == len(obj.legs()):
+            obj.legs_placed()
+            continue
+        for side in sides:
+            orphans.append((obj, side))
+        obj.message = f"{obj.dct['tsym']} order failed, placed {sides}"
+        logging.warning(f"{obj.message} will be cancelled")
+        obj.dct["fn"] = None
+
+    resps = submit_all(
+        "order_cancel",
+        [
+            dict(order_id=obj.dct[f"{side}_id"], variety="NORMAL")
+            for obj, side in orphans
+        ],
+    )
+    failed = [
+        obj.dct["tsym"]
+        for (obj, _), resp in zip(orphans, resps)
+        if isinstance(resp, Exception)
+    ]
+    if any(failed):
+        logging.error(f"could not cancel lone legs of {failed}")
+
+    stats = dict(
+        strategies=len(pending),
+        orders=len(legs),
+        placed=sum(len(sides) for sides in placed.values()),
+        cancelled=len(orphans) - len(failed),
+        seconds=round(time.monotonic() - started, 3),
+    )
+    logging.info(f"initial orders {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    class Fake:
+        def __init__(self, tsym, fail=None):
+            self.dct = dict(tsym=tsym, fn=self.place_both_orders)
+            self.dct["buy_args"] = dict(symbol=tsym, side="BUY", fail=fail == "buy")
+            self.dct["sell_args"] = dict(symbol=tsym, side="SELL", fail=fail == "sell")
+            self.message = ""
+
+        def place_both_orders(self):
+            pass
+
+        def legs(self):
+            return ["buy", "sell"]
+
+        def legs_placed(self):
+            self.dct["fn"] = None
+            self.message = "placed"
+
+    class FakeApi:
+        def order_place(self, **kwargs):
+            return "" if kwargs["fail"] else f"{kwargs['symbol']}-{kwargs['side']}"
+
+        def order_cancel(self, **kwargs):
+            print("cancel", kwargs)
+
+    Helper.ao = FakeApi()
+    objs = [Fake(f"SYM{i}", fail="sell" if i == 3 else None) for i in range(30)]
+    print(place_initial_orders(objs))
+    print(objs[3].dct["buy_id"], objs[3].message, objs[4].message)
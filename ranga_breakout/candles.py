@@ -0,0 +1,290 @@
+from traceback import print_exc
+import threading
+
+import pendulum as pdlm
+from toolkit.kokoo import dt_to_str
+
+from __init__ import logging, O_SETG, TZ
+from history import Candles, carry_stops, get_historical_data, get_historical_many
+
+MINUTES = {
+    "ONE_MINUTE": 1,
+    "THREE_MINUTE": 3,
+    "FIVE_MINUTE": 5,
+    "TEN_MINUTE": 10,
+    "FIFTEEN_MINUTE": 15,
+    "THIRTY_MINUTE": 30,
+    "ONE_HOUR": 60,
+}
+INTERVALS = {v: k for k, v in MINUTES.items()}
+
+
+def _check_minutes(minutes) -> int:
+    if minutes not in INTERVALS:
+        raise ValueError(
+            f"candle_minutes {minutes!r} in settings is not one of {list(INTERVALS)}"
+        )
+    return minutes
+
+
+# a bad setting stops the start, not a strategy halfway through the day
+_check_minutes(O_SETG.get("candle_minutes", 15))
+
+
+def candle_interval() -> str:
+    """interval name of candle_minutes in settings"""
+    return INTERVALS[_check_minutes(O_SETG.get("candle_minutes", 15))]
+
+
+def _to_fromdate(timestamp: str) -> str:
+    # "2024-10-11T09:15:00+05:30" -> "2024-10-11 09:15"
+    return timestamp[:16].replace("T", " ")
+
+
+class BarBuilder:
+    """
+    builds ohlcv bars of `minutes` from ticks, aligned to the session
+    open, bars look like the broker's [timestamp, o, h, l, c, v]
+    """
+
+    def __init__(self, minutes=15, session_open="9:15", on_close=None):
+        self.minutes = minutes
+        self.on_close = on_close
+        self._interval_ms = minutes * 60 * 1000
+        self._open = [int(x) for x in session_open.split(":")]
+        self._day = None
+        self._open_ms = 0
+        self._closed = {}
+        self._forming = {}
+        self._seeded = set()
+        self._lock = threading.Lock()
+
+    def _bucket(self, exchange_ts: int) -> int:
+        # IST day of the tick, the session open is recomputed when it changes
+        day = (exchange_ts + 19800000) // 86400000
+        if day != self._day:
+            self._day = day
+            self._open_ms = (
+                pdlm.from_timestamp(exchange_ts / 1000, tz=TZ)
+                .replace(
+                    hour=self._open[0], minute=self._open[1], second=0, microsecond=0
+                )
+                .int_timestamp
+                * 1000
+            )
+        return self._open_ms + (
+            (exchange_ts - self._open_ms) // self._interval_ms
+        ) * self._interval_ms
+
+    def _close(self, token):
+        start, o, h, l, c, v = self._forming.pop(token)
+        bar = [
+            pdlm.from_timestamp(start / 1000, tz=TZ).to_iso8601_string(),
+            o,
+            h,
+            l,
+            c,
+            v,
+        ]
+        self._closed.setdefault(token, []).append(bar)
+        if self.on_close is not None:
+            self.on_close(token, bar)
+
+    def on_tick(self, token, ltp, exchange_ts, volume=0):
+        with self._lock:
+            start = self._bucket(exchange_ts)
+            if start < self._open_ms:
+                return
+            bar = self._forming.get(token, None)
+            if bar is not None and start > bar[0]:
+                self._close(token)
+                bar = None
+            if bar is None:
+                self._forming[token] = [start, ltp, ltp, ltp, ltp, volume]
+            elif start == bar[0]:
+                bar[2] = max(bar[2], ltp)
+                bar[3] = min(bar[3], ltp)
+                bar[4] = ltp
+                bar[5] += volume
+
+    def flush(self, now_ms: int):
+        """close bars whose interval is over even if no tick came after"""
+        with self._lock:
+            for token in [
+                token
+                for token, bar in self._forming.items()
+                if now_ms >= bar[0] + self._interval_ms
+            ]:
+                self._close(token)
+
+    def seed(self, token, bars: list):
+        """
+        history from the broker up to now, the last bar is still forming
+        and is merged with whatever ticks already built for it
+        """
+        with self._lock:
+            if token in self._seeded or not any(bars):
+                return
+            self._seeded.add(token)
+            closed = [list(bar) for bar in bars[:-1]]
+            ts, o, h, l, c, v = bars[-1]
+            start = pdlm.parse(ts).int_timestamp * 1000
+            forming = self._forming.get(token, None)
+            if forming is None:
+                self._forming[token] = [start, o, h, l, c, v]
+            elif forming[0] == start:
+                forming[1] = o
+                forming[2] = max(forming[2], h)
+                forming[3] = min(forming[3], l)
+                forming[5] = max(forming[5], v)
+            elif forming[0] > start:
+                closed.append(list(bars[-1]))
+            last = closed[-1][0] if any(closed) else ""
+            # bars closed from ticks after the broker's history are kept
+            closed += [bar for bar in self._closed.get(token, []) if bar[0] > last]
+            self._closed[token] = closed
+
+    def has(self, token) -> bool:
+        """True once the token has the whole day, not just ticks"""
+        return token in self._seeded
+
+    def get(self, token) -> list:
+        """closed bars followed by the forming one, like the broker returns"""
+        with self._lock:
+            bars = [list(bar) for bar in self._closed.get(token, [])]
+            if token in self._forming:
+                start, o, h, l, c, v = self._forming[token]
+                ts = pdlm.from_timestamp(start / 1000, tz=TZ).to_iso8601_string()
+                bars.append([ts, o, h, l, c, v])
+            return bars
+
+    def reconcile(self, token, broker_bars: list, tolerance=0.05) -> list:
+        """closed bars that differ from the broker's, as (ts, field, ours, theirs)"""
+        ours = {bar[0]: bar for bar in self._closed.get(token, [])}
+        mismatches = []
+        for bar in broker_bars:
+            mine = ours.get(bar[0], None)
+            if mine is None:
+                mismatches.append((bar[0], "missing", None, bar[4]))
+                continue
+            for idx, field in [(1, "o"), (2, "h"), (3, "l"), (4, "c")]:
+                if abs(float(mine[idx]) - float(bar[idx])) > tolerance:
+                    mismatches.append((bar[0], field, mine[idx], bar[idx]))
+        return mismatches
+
+
+def reconcile_day(builder: BarBuilder, params: dict, interval="FIFTEEN_MINUTE"):
+    """cross check every token the builder saw against getCandleData"""
+    try:
+        dct_of_params = {
+            v["token"]: {
+                "exchange": v["exchange"],
+                "symboltoken": v["token"],
+                "interval": interval,
+                "fromdate": dt_to_str("9:15"),
+                "todate": dt_to_str(""),
+            }
+            for v in params.values()
+            if builder.has(v["token"])
+        }
+        resp, _ = get_historical_many(dct_of_params)
+        report = {}
+        for token, broker_bars in resp.items():
+            # the broker's last bar may still be forming
+            mismatches = builder.reconcile(token, broker_bars[:-1])
+            if any(mismatches):
+                report[token] = mismatches
+                logging.warning(f"{token} bars differ from broker {mismatches}")
+        logging.info(f"reconciled {len(resp)} tokens, {len(report)} differ")
+        return report
+    except Exception as e:
+        logging.error(f"{e} while reconciling bars")
+        print_exc()
+        return {}
+
+
+class CandleCache:
+    """
+    intraday bars by token, after the first call only the last
+    (possibly still forming) bar onwards is fetched from the broker.
+    when a BarBuilder is attached for the interval, bars of tokens
+    it is building come from ticks with no api call at all
+    """
+
+    def __init__(self):
+        self._bars = {}
+        self._typed = {}
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.builders = {}
+
+    def _to_candles(self, key, bars) -> Candles:
+        """convert only when the bars changed since the last call"""
+        version = (len(bars), tuple(bars[-1]) if any(bars) else None)
+        cached = self._typed.get(key, None)
+        if cached is None or cached[0] != version:
+            candles = Candles.from_rows(bars)
+            if cached is not None:
+                # stops filled at the candle close survive the refetch
+                carry_stops(cached[1], candles)
+            cached = (version, candles)
+            self._typed[key] = cached
+        return cached[1]
+
+    def attach(self, interval, builder: BarBuilder):
+        self.builders[interval] = builder
+
+    def _merge(self, key, resp):
+        bars = self._bars.get(key, [])
+        first = resp[0][0]
+        # the refetched bar replaces the one we held
+        bars = [bar for bar in bars if bar[0] < first] + resp
+        self._bars[key] = bars
+        return bars
+
+    def peek(self, exchange, token, interval="FIFTEEN_MINUTE"):
+        """what get would return without calling the broker, None if unknown"""
+        builder = self.builders.get(interval, None)
+        if builder is not None and builder.has(token):
+            return self._to_candles(("ticks", token, interval), builder.get(token))
+        key = (exchange, token, interval)
+        if key in self._bars:
+            return self._to_candles(key, self._bars[key])
+        return None
+
+    def get(self, exchange, token, interval="FIFTEEN_MINUTE", to="") -> Candles:
+        builder = self.builders.get(interval, None)
+        if builder is not None and to == "" and builder.has(token):
+            return self._to_candles(("ticks", token, interval), builder.get(token))
+        key = (exchange, token, interval)
+        with self._lock:
+            bars = self._bars.get(key, [])
+            try:
+                fromdate = _to_fromdate(bars[-1][0]) if any(bars) else dt_to_str("9:15")
+                params = {
+                    "exchange": exchange,
+                    "symboltoken": token,
+                    "interval": interval,
+                    "fromdate": fromdate,
+                    "todate": dt_to_str(to),
+                }
+                resp = get_historical_data(params)
+                if resp is not None and any(resp):
+                    self.fetched += len(resp)
+                    bars = self._merge(key, resp)
+                    if builder is not None and to == "":
+                        # ticks carry on from here
+                        builder.seed(token, bars)
+            except Exception as e:
+                logging.error(f"{e} while getting cached candles for {token}")
+                print_exc()
+            finally:
+                return self._to_candles(key, bars)
+
+    def clear(self):
+        with self._lock:
+            self._bars.clear()
+            self._typed.clear()
+
+
+O_CANDLES = CandleCache()
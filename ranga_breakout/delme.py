@@ -82,7 +82,7 @@ class Breakout:
 
     def _buy_trade(self, args):
         # Place buy order
-        resp = Helper.api.order_place(**args["buy_args"])
+        resp = Helper.order_place(**args["buy_args"])
         logging.debug(
             f"{args['buy_args']['symbol']} {args['buy_args']['side']} got {resp=}"
         )
@@ -91,7 +91,7 @@ class Breakout:
 
     def _sell_trade(self, args):
         # Place sell order
-        resp = Helper.api.order_place(**args["sell_args"])
+        resp = Helper.order_place(**args["sell_args"])
         logging.debug(
             f"{args['sell_args']['symbol']} {args['sell_args']['side']} got {resp=}"
         )
@@ -261,7 +261,7 @@ class Breakout:
                     """
                     if any(args):
                         logging.debug(f"order modify {args}")
-                        resp = Helper.api.order_modify(**args)
+                        resp = Helper.order_modify(**args)
                         logging.debug(f"order modify {resp}")
                         self.candle_count = len(candles_now)
                         self.candle_other = len(candles_now)
@@ -308,7 +308,7 @@ class Breakout:
 
 
 if __name__ == "__main__":
-    from main import get_ltp
+    from market import get_ltp
     from universe import stocks_in_play
     from history import get_candles
 
@@ -0,0 +1,227 @@
+from traceback import print_exc
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+import pendulum as pdlm
+
+from __init__ import O_SETG, SESSION_OPEN, logging
+from api import Helper
+from market import O_BOOK, O_FEED, O_ORDERS, O_LOCK, get_ltp, start_feed
+from candles import O_CANDLES, BarBuilder, candle_interval, reconcile_day
+from history import fill_stops
+from latency import O_LATENCY, timed
+
+
+def _today_at(hh_mm: str):
+    parts = [int(x) for x in hh_mm.split(":")] + [0, 0]
+    return pdlm.now().replace(
+        hour=parts[0], minute=parts[1], second=parts[2], microsecond=0
+    )
+
+
+def seconds_until(hh_mm: str) -> float:
+    return max(0.0, (_today_at(hh_mm) - pdlm.now()).total_seconds())
+
+
+def sleep_until(hh_mm: str):
+    wait = seconds_until(hh_mm)
+    print("clock:", pdlm.now().format("HH:mm:ss"), "zzz ", hh_mm)
+    time.sleep(wait)
+
+
+def seconds_to_candle_close(minutes: int, session_open=SESSION_OPEN) -> float:
+    """seconds until the current bar closes, bars are aligned to the open"""
+    elapsed = (pdlm.now() - _today_at(session_open)).total_seconds()
+    if elapsed < 0:
+        return -elapsed + minutes * 60
+    return minutes * 60 - elapsed % (minutes * 60)
+
+
+class Engine:
+    """
+    runs a strategy only when something it cares about happened, a tick
+    or order update on its token, a candle close or the polling timer
+    when the feeds are not live. strategies run one at a time on a
+    worker thread so the event loop never blocks on the broker.
+    """
+
+    def __init__(self, strategies: list, params: dict, snapshots=None):
+        self.strategies = list(strategies)
+        self.params = params
+        self.snapshots = snapshots
+        self.poll = O_SETG.get("poll", 1)
+        self.candle_minutes = O_SETG.get("candle_minutes", 15)
+        self.candle_other = 2
+        self.wakes = 0
+        self.builder = None
+        self._polled_ltp = {}
+        self._by_token = {}
+        for obj in self.strategies:
+            self._by_token.setdefault(obj.dct["token"], []).append(obj)
+        self._pending = {}
+        self._loop = None
+        self._wakeup = None
+        self._stop = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    """
+        events, the callbacks may come from any thread
+    """
+
+    def _live(self) -> list:
+        return [obj for obj in self.strategies if obj.dct["fn"] is not None]
+
+    def _owners(self, order_id) -> list:
+        return [
+            obj
+            for obj in self._live()
+            if order_id in [obj.dct["buy_id"], obj.dct["sell_id"]]
+        ]
+
+    def wake(self, objs: list):
+        for obj in objs:
+            if obj.dct["fn"] is not None:
+                self._pending[id(obj)] = obj
+        if any(self._pending):
+            self._wakeup.set()
+
+    def _wake_threadsafe(self, objs: list):
+        if self._loop is not None and any(objs):
+            self._loop.call_soon_threadsafe(self.wake, objs)
+
+    def on_tick(self, token, ltp, exchange_ts):
+        if self.builder is not None:
+            self.builder.on_tick(token, ltp, exchange_ts)
+        self._wake_threadsafe(self._by_token.get(token, []))
+
+    def _on_bar(self, token, bar):
+        self.on_candle(token)
+
+    def on_order(self, order):
+        self._wake_threadsafe(self._owners(order["orderid"]))
+
+    def on_candle(self, token=None):
+        """a bar closed, for one token or for all when token is None"""
+        objs = self._by_token.get(token, []) if token else self._live()
+        self._wake_threadsafe(objs)
+
+    """
+        work done on the executor thread
+    """
+
+    @timed()
+    def _fill_stops(self):
+        """one vectorised stop pass over every live token's candles"""
+        lst_of_candles = [
+            O_CANDLES.peek(obj.dct["exchange"], obj.dct["token"], candle_interval())
+            for obj in self._live()
+        ]
+        fill_stops([c for c in lst_of_candles if c is not None])
+
+    def _run_one(self, obj):
+        try:
+            dct_of_ltp = O_FEED.ltp if O_FEED.is_live() else self._polled_ltp
+            with O_LOCK:
+                obj.run(O_BOOK, dct_of_ltp, self.candle_other)
+            self.candle_other = obj.candle_count
+            print("last message: ", obj.message)
+            if self.snapshots is not None:
+                self.snapshots.record([obj])
+        except Exception as e:
+            logging.error(f"{e} while engine running {obj.dct['tsym']}")
+            print_exc()
+
+    @timed()
+    def _refresh(self) -> list:
+        """poll whatever is not streamed, returns strategies to wake"""
+        objs = []
+        if not O_ORDERS.connected.is_set():
+            lst_of_orders = Helper.orders
+            with O_LOCK:
+                changed = O_BOOK.update(lst_of_orders)
+            for order_id in changed:
+                objs += self._owners(order_id)
+        if not O_FEED.is_live():
+            self._polled_ltp = get_ltp(self.params)
+            objs = self._live()
+        return objs
+
+    """
+        coroutines
+    """
+
+    async def _worker(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            pending, self._pending = self._pending, {}
+            started = time.perf_counter()
+            for obj in pending.values():
+                if obj.dct["fn"] is not None:
+                    self.wakes += 1
+                    await self._loop.run_in_executor(self._executor, self._run_one, obj)
+            # every strategy woken together, one cycle of the old loop
+            O_LATENCY.record("engine.Engine.cycle", time.perf_counter() - started)
+
+    async def _poller(self):
+        while True:
+            try:
+                objs = await self._loop.run_in_executor(None, self._refresh)
+                self.wake(objs)
+            except Exception as e:
+                logging.error(f"{e} while engine polling")
+                print_exc()
+            await asyncio.sleep(self.poll)
+
+    async def _candles(self):
+        while True:
+            # give the broker a few seconds to publish the closed bar
+            await asyncio.sleep(seconds_to_candle_close(self.candle_minutes) + 5)
+            try:
+                if self.builder is not None:
+                    self.builder.flush(pdlm.now().int_timestamp * 1000)
+                await self._loop.run_in_executor(self._executor, self._fill_stops)
+                self.on_candle()
+            except Exception as e:
+                logging.error(f"{e} while engine closing candles")
+                print_exc()
+
+    async def _stopper(self):
+        await asyncio.sleep(seconds_until(O_SETG["stop"]))
+        self._stop.set()
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stop = asyncio.Event()
+        if O_SETG.get("feed", False):
+            # candles of the strategies' interval are built from ticks
+            self.builder = BarBuilder(self.candle_minutes, on_close=self._on_bar)
+            O_CANDLES.attach(candle_interval(), self.builder)
+            O_FEED.on_tick = self.on_tick
+            start_feed(self.params)
+        if O_SETG.get("order_feed", False):
+            O_ORDERS.on_update = self.on_order
+            O_ORDERS.start()
+        tasks = [
+            asyncio.create_task(coro)
+            for coro in [self._worker(), self._poller(), self._candles(), self._stopper()]
+        ]
+        # every state machine gets a first run
+        self.wake(self._live())
+        await self._stop.wait()
+        for task in tasks:
+            task.cancel()
+        logging.info(f"engine stopped after {self.wakes} wakes")
+        if self.snapshots is not None:
+            self.snapshots.checkpoint()
+        if self.builder is not None and O_SETG.get("reconcile", False):
+            await self._loop.run_in_executor(
+                None, reconcile_day, self.builder, self.params, candle_interval()
+            )
+
+    def run(self):
+        """blocks until the stop time in settings"""
+        asyncio.run(self._main())
+        self._executor.shutdown(wait=True)
@@ -1,32 +1,39 @@
 from __init__ import CNFG, S_DATA, O_UTIL, logging
 import pandas as pd
 from api import Helper
+from bulk import submit_all
 from traceback import print_exc
+import time
 
 
-def cancel_all_orders():
+# an exit in any other state may still fill
+TERMINAL = ["complete", "rejected", "cancelled"]
+
+
+def _open_orders(lst_of_orders) -> list:
+    return [o for o in lst_of_orders if o["status"] in ["open", "trigger pending"]]
+
+
+def _fetch(endpoint: str):
+    """orders or positions from the broker, None when they could not be read"""
     try:
-        resp = Helper.orders
-        print(type(resp))
-        for order in resp:
-            print(order)
-            if order["status"] in ["open", "trigger pending"]:
-                # O_UTIL.slp_til_nxt_sec()
-                logging.info(f"close all: cancelling order {order['orderid']}")
-                Helper.api.order_cancel(order_id=order["orderid"], variety="NORMAL")
+        resp = Helper.scheduler.call(endpoint, lambda: getattr(Helper.api, endpoint))
+        if not isinstance(resp, dict) or not resp.get("status", False):
+            raise Exception(f"unexpected {resp=}")
+        # angel one sends no data when the book is empty
+        return resp["data"] or []
     except Exception as e:
-        print_exc()
-        print(e)
+        logging.error(f"{e} while flatten is getting {endpoint}")
+        return None
 
 
-def close_all_positions():
-    try:
-        resp = Helper.positions
-        for params in resp:
-            print(params)
-            quantity = int(params["netqty"])
-            if quantity != 0 and params["producttype"] == "INTRADAY":
-                order_params = {
+def _squareoff_params(lst_of_positions) -> list:
+    lst = []
+    for params in lst_of_positions:
+        quantity = int(params["netqty"])
+        if quantity != 0 and params["producttype"] == "INTRADAY":
+            lst.append(
+                {
                     "variety": "NORMAL",
                     "tradingsymbol": params["tradingsymbol"],
                     "symboltoken": params["symboltoken"],
@@ -39,13 +46,113 @@ def close_all_positions():
                     "triggerprice": "0",
                     "quantity": abs(quantity),
                 }
-                logging.info(f"Closing position for {params['tradingsymbol']}")
-                # O_UTIL.slp_til_nxt_sec()
-                resp = Helper.api.order_place(**order_params)
-                logging.info(resp)
+            )
+    return lst
+
+
+def cancel_all_orders(lst_of_orders=None, keep=()) -> int:
+    """
+    cancel open and trigger pending orders in parallel, except the
+    order ids in keep, returns how many
+    """
+    try:
+        if lst_of_orders is None:
+            lst_of_orders = Helper.orders
+        lst = [o for o in _open_orders(lst_of_orders) if o["orderid"] not in keep]
+        for order in lst:
+            logging.info(f"close all: cancelling order {order['orderid']}")
+        submit_all(
+            "order_cancel",
+            [dict(order_id=o["orderid"], variety="NORMAL") for o in lst],
+        )
+        return len(lst)
     except Exception as e:
         print_exc()
         print(e)
+        return 0
+
+
+def close_all_positions(lst_of_positions=None) -> dict:
+    """
+    square off intraday positions in parallel, returns the exit
+    order id by token of those the broker took
+    """
+    try:
+        if lst_of_positions is None:
+            lst_of_positions = Helper.positions
+        lst = _squareoff_params(lst_of_positions)
+        for order_params in lst:
+            logging.info(f"Closing position for {order_params['tradingsymbol']}")
+        exits = {}
+        for order_params, resp in zip(lst, submit_all("order_place", lst)):
+            logging.info(resp)
+            if isinstance(resp, str) and len(resp) > 0:
+                exits[order_params["symboltoken"]] = resp
+        return exits
+    except Exception as e:
+        print_exc()
+        print(e)
+        return {}
+
+
+def _to_close(lst_of_positions, lst_of_orders, exits: dict) -> list:
+    """
+    positions that need an exit now. a token whose last exit is not
+    done yet is left alone, and so is one whose exit filled while the
+    positions still show the quantity it closed, they lag the orders
+    """
+    status = {o["orderid"]: o["status"] for o in lst_of_orders}
+    lst = []
+    for params in lst_of_positions:
+        order_id, netqty = exits.get(params["symboltoken"], (None, None))
+        if order_id is not None:
+            if status.get(order_id, None) not in TERMINAL:
+                continue
+            if status[order_id] == "complete" and params["netqty"] == netqty:
+                continue
+        lst.append(params)
+    return lst
+
+
+def flatten(retries=3, settle=1) -> dict:
+    """
+    cancel everything pending and square off every intraday position,
+    then read the book again and repeat for whatever is left over.
+    a book that could not be read is never taken as flat
+    """
+    started = time.monotonic()
+    stats = dict(cancelled=0, closed=0, rounds=0, flat=False)
+    # token: (exit order id, netqty it closed)
+    exits = {}
+    for _ in range(retries + 1):
+        stats["rounds"] += 1
+        orders = _fetch("orders")
+        if orders is not None:
+            keep = [order_id for order_id, _ in exits.values()]
+            stats["cancelled"] += cancel_all_orders(orders, keep)
+            # a cancel may race a fill, so positions are read afterwards
+            positions = _fetch("positions")
+            if positions is not None:
+                lst = _to_close(positions, orders, exits)
+                closed = close_all_positions(lst)
+                netqty = {p["symboltoken"]: p["netqty"] for p in lst}
+                exits.update({k: (v, netqty[k]) for k, v in closed.items()})
+                stats["closed"] += len(closed)
+        time.sleep(settle)
+        orders, positions = _fetch("orders"), _fetch("positions")
+        if orders is None or positions is None:
+            logging.warning("flatten could not read the book, trying again")
+            continue
+        orders, positions = _open_orders(orders), _squareoff_params(positions)
+        if not any(orders) and not any(positions):
+            stats["flat"] = True
+            break
+        logging.warning(
+            f"flatten left {len(orders)} orders and {len(positions)} positions"
+        )
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    logging.info(f"flatten {stats} {Helper.stats()}")
+    return stats
 
 
 def save_to_csv():
@@ -66,6 +173,5 @@ def save_to_csv():
 
 if __name__ == "__main__":
     Helper.api
-    cancel_all_orders()
-    close_all_positions()
+    flatten()
     # save_to_csv()
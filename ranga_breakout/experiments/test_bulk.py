@@ -0,0 +1,78 @@
+from functools import partial
+
+import pandas as pd
+import pytest
+
+from api import Helper, LIMITS
+from ratelimit import Inline
+from journal import OrderJournal
+from simbroker import SimBroker, random_day
+from bulk import place_initial_orders
+from breakout import Breakout
+from oneside import Oneside
+
+
+def _param(token):
+    return dict(
+        tsym=f"SYM{token}-EQ",
+        exchange="NSE",
+        h=101,
+        l=99,
+        c=100,
+        quantity=1,
+        token=token,
+    )
+
+
+@pytest.fixture
+def broker():
+    saved = (Helper.ao, Helper.scheduler, Helper.journal)
+    Helper.ao = SimBroker({})
+    Helper.scheduler = Inline(LIMITS)
+    Helper.journal = OrderJournal(path=None)
+    yield Helper.ao
+    Helper.ao, Helper.scheduler, Helper.journal = saved
+
+
+def test_place_initial_orders_with_oneside(broker):
+    """Oneside places its own entry, bulk only sends the others' legs"""
+    oneside = Oneside(_param("1000"), "buy")
+    breakout = Breakout(dict(_param("1001"), side="buy"))
+
+    stats = place_initial_orders([oneside, breakout])
+
+    assert stats["strategies"] == 1
+    assert stats["placed"] == 2
+    assert oneside.dct["buy_id"] is None
+    assert oneside.dct["fn"] == oneside.place_entry
+    assert breakout.dct["buy_id"] and breakout.dct["sell_id"]
+    assert len(broker.orders["data"]) == 2
+
+
+def test_oneside_places_entry_on_first_run(broker):
+    oneside = Oneside(_param("1000"), "buy")
+    assert len(broker.orders["data"]) == 0
+
+    oneside.run([], {}, 0)
+
+    assert oneside.dct["buy_id"]
+    assert oneside.dct["fn"] == oneside.if_complete_place_stop
+    assert len(broker.orders["data"]) == 1
+
+
+def test_backtest_with_oneside():
+    # the backtest moves the clock with pendulum's travel_to
+    pytest.importorskip("time_machine")
+    from backtest import Backtest
+    from history import get_candles
+
+    tokens = [str(1000 + i) for i in range(5)]
+    universe = pd.DataFrame(
+        dict(symbol=[f"SYM{t}-EQ" for t in tokens], exchange="NSE", token=tokens)
+    ).assign(quantity=1)
+    make = partial(Oneside, dir="buy")
+
+    result = Backtest(random_day(tokens), universe, make, get_candles).run()
+
+    assert result["strategies"] == len(tokens)
+    assert result["runs"] > 0
@@ -0,0 +1,266 @@
+from traceback import print_exc
+import json
+import struct
+import threading
+import time
+
+import websocket
+
+from __init__ import logging, CNFG
+
+WS_URL = "wss://smartapisocket.angelone.in/smart-stream"
+ORDER_URL = "wss://tns.angelone.in/smart-order-update"
+EXCHANGE_TYPE = {"NSE": 1, "NFO": 2, "BSE": 3, "BFO": 4, "MCX": 5, "NCDEX": 7, "CDS": 13}
+LTP_MODE = 1
+HEARTBEAT = 10
+# layout of the ltp packet: mode, exchange type, token, sequence,
+# exchange timestamp in ms and ltp in paise, little endian
+LTP_PACKET = struct.Struct("<BB25sqqq")
+
+
+def parse_tick(data: bytes) -> tuple[str, float, int]:
+    """token, ltp in rupees and exchange timestamp in ms of a binary tick"""
+    _, _, token, _, exchange_ts, ltp = LTP_PACKET.unpack_from(data)
+    return token.split(b"\x00", 1)[0].decode(), ltp / 100, exchange_ts
+
+
+def pack_tick(token, ltp, exchange="NSE", seq=0, exchange_ts=0) -> bytes:
+    """inverse of parse_tick, used to record or replay ticks"""
+    return LTP_PACKET.pack(
+        LTP_MODE,
+        EXCHANGE_TYPE[exchange],
+        str(token).encode(),
+        seq,
+        exchange_ts,
+        int(round(ltp * 100)),
+    )
+
+
+def _jwt() -> str:
+    from api import Helper
+
+    jwt = Helper.api.obj.access_token
+    if not jwt.startswith("Bearer "):
+        jwt = f"Bearer {jwt}"
+    return jwt
+
+
+def order_headers() -> dict[str, str]:
+    return {"Authorization": _jwt()}
+
+
+def auth_headers() -> dict[str, str]:
+    """headers of an authenticated angel one session"""
+    from api import Helper
+
+    return {
+        "Authorization": _jwt(),
+        "x-api-key": CNFG["api_key"],
+        "x-client-code": CNFG["user_id"],
+        "x-feed-token": Helper.api.obj.getfeedToken(),
+    }
+
+
+class Stream:
+    """
+    websocket client that reconnects forever until stopped,
+    with the text heartbeat angel one expects
+    """
+
+    def __init__(self, url, headers=auth_headers, reconnect_after=1, max_backoff=30):
+        self.url = url
+        self._headers = headers
+        self.reconnect_after = reconnect_after
+        self.max_backoff = max_backoff
+        self.connected = threading.Event()
+        self.reconnects = 0
+        self._stopped = threading.Event()
+        self._ws = None
+        self._thread = None
+
+    def on_connect(self):
+        """called after every (re)connect"""
+        pass
+
+    def on_message(self, message):
+        pass
+
+    def _on_open(self, ws):
+        self.connected.set()
+        logging.info(f"{self.__class__.__name__} connected to {self.url}")
+        threading.Thread(target=self._heartbeat, args=(ws,), daemon=True).start()
+        self.on_connect()
+
+    def _on_message(self, ws, message):
+        try:
+            if message == "pong":
+                return
+            self.on_message(message)
+        except Exception as e:
+            logging.error(f"{e} while handling {self.__class__.__name__} message")
+            print_exc()
+
+    def _on_error(self, ws, error):
+        logging.warning(f"{self.__class__.__name__} {error}")
+
+    def _on_close(self, ws, code, reason):
+        self.connected.clear()
+        logging.info(f"{self.__class__.__name__} closed {code} {reason}")
+
+    def _heartbeat(self, ws):
+        while self.connected.is_set() and ws is self._ws:
+            try:
+                ws.send("ping")
+            except Exception:
+                return
+            self._stopped.wait(HEARTBEAT)
+
+    def _run(self):
+        backoff = self.reconnect_after
+        while not self._stopped.is_set():
+            try:
+                headers = self._headers() if callable(self._headers) else self._headers
+                self._ws = websocket.WebSocketApp(
+                    self.url,
+                    header=headers,
+                    on_open=self._on_open,
+                    on_message=self._on_message,
+                    on_error=self._on_error,
+                    on_close=self._on_close,
+                )
+                started = time.monotonic()
+                self._ws.run_forever()
+                # a connection that lived a while resets the back off
+                if time.monotonic() - started > self.max_backoff:
+                    backoff = self.reconnect_after
+            except Exception as e:
+                logging.error(f"{e} while running {self.__class__.__name__}")
+                print_exc()
+            finally:
+                self.connected.clear()
+            if self._stopped.wait(backoff):
+                break
+            self.reconnects += 1
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def send(self, message):
+        if self.connected.is_set():
+            self._ws.send(message)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._ws is not None:
+            self._ws.close()
+
+
+class TickFeed(Stream):
+    """
+    keeps a live token -> ltp table from the smart stream,
+    subscriptions are replayed after every reconnect
+    """
+
+    def __init__(self, url=WS_URL, headers=auth_headers, **kwargs):
+        super().__init__(url, headers, **kwargs)
+        self.ltp = {}
+        self.ticks = 0
+        self.last_tick = 0.0
+        self.on_tick = None
+        self._subscribed = {}
+
+    def _subscribe_message(self, dct_of_tokens) -> str:
+        return json.dumps(
+            {
+                "correlationID": "ltp",
+                "action": 1,
+                "params": {
+                    "mode": LTP_MODE,
+                    "tokenList": [
+                        {"exchangeType": EXCHANGE_TYPE[exch], "tokens": list(tokens)}
+                        for exch, tokens in dct_of_tokens.items()
+                    ],
+                },
+            }
+        )
+
+    def subscribe(self, exch, tokens):
+        tokens = [str(t) for t in tokens]
+        self._subscribed.setdefault(exch, set()).update(tokens)
+        self.send(self._subscribe_message({exch: tokens}))
+
+    def on_connect(self):
+        if any(self._subscribed):
+            self.send(self._subscribe_message(self._subscribed))
+
+    def on_message(self, message):
+        if isinstance(message, bytes) and len(message) >= LTP_PACKET.size:
+            token, ltp, exchange_ts = parse_tick(message)
+            self.ltp[token] = ltp
+            self.ticks += 1
+            self.last_tick = time.monotonic()
+            if self.on_tick is not None:
+                self.on_tick(token, ltp, exchange_ts)
+
+    def is_live(self) -> bool:
+        return self.connected.is_set() and any(self.ltp)
+
+
+class OrderFeed(Stream):
+    """
+    applies streamed order updates to an OrderBook and hands
+    every changed order to on_update as soon as it arrives
+    """
+
+    def __init__(
+        self, book, url=ORDER_URL, headers=order_headers, lock=None, **kwargs
+    ):
+        super().__init__(url, headers, **kwargs)
+        self.book = book
+        # whatever else guards the book, strategies read it under it
+        self.lock = threading.RLock() if lock is None else lock
+        self.updates = 0
+        self.on_update = None
+
+    def on_message(self, message):
+        dct = json.loads(message)
+        order = dct.get("orderData", None)
+        if not isinstance(order, dict):
+            return
+        with self.lock:
+            changed = self.book.update_one(order)
+        if changed:
+            self.updates += 1
+            if self.on_update is not None:
+                self.on_update(self.book.get(order["orderid"]))
+
+
+if __name__ == "__main__":
+    from replay import ReplayServer
+    from orderbook import OrderBook
+
+    frames = [(0.01, pack_tick("2885", 2900 + i / 20, seq=i)) for i in range(40)]
+    server = ReplayServer(frames, wait_for_message=True, drop_after=15).start()
+    feed = TickFeed(url=server.url, headers={}, reconnect_after=0.1)
+    feed.subscribe("NSE", ["2885"])
+    feed.start()
+    time.sleep(2)
+    print(f"{feed.ltp=} {feed.ticks=} {feed.reconnects=} {server.received=}")
+    feed.stop()
+    server.stop()
+
+    frames = [(0, json.dumps({"order-status": "AB00", "status-code": "200"}))]
+    for status in ["open", "trigger pending", "complete"]:
+        order = dict(orderid="241127000230561", symboltoken="2885", status=status)
+        frames.append((0.05, json.dumps({"order-status": "AB", "orderData": order})))
+    server = ReplayServer(frames).start()
+    orders = OrderFeed(OrderBook(), url=server.url, headers={})
+    orders.on_update = lambda order: print("order update", order)
+    orders.start()
+    time.sleep(1)
+    orders.stop()
+    server.stop()
@@ -1,12 +1,17 @@
 from decorator import retry
 from traceback import print_exc
 from typing import Any  # Importing only the required types
-from __init__ import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from __init__ import logging, O_SETG
 from toolkit.kokoo import dt_to_str
 from api import Helper
 import numpy as np
 import pandas as pd
 
+HISTORY_WORKERS = 5
+
 
 def get_historical_data(historic_param: dict[str, Any]) -> Any:
     try:
@@ -14,7 +19,7 @@ def get_historical_data(historic_param: dict[str, Any]) -> Any:
 
         @retry(max_attempts=3)
         def fetch_data() -> Any:
-            return Helper.api.obj.getCandleData(historic_param)
+            return Helper.candle_data(historic_param)
 
         data = fetch_data()
     except Exception as e:
@@ -24,12 +29,206 @@ def get_historical_data(historic_param: dict[str, Any]) -> Any:
         return data
 
 
-def find_buy_stop(candles_data):
-    np_data = np.array(candles_data)
+def get_historical_many(
+    dct_of_params: dict[str, dict[str, Any]], max_workers=HISTORY_WORKERS
+) -> tuple[dict[str, Any], dict[str, str]]:
+    """
+    fetch candles for many keys concurrently, Helper paces the calls
+
+    Returns:
+        candles by key, and error message by key for those that failed
+    """
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(get_historical_data, param): key
+            for key, param in dct_of_params.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                resp = future.result()
+                if resp is not None and any(resp) and any(resp[0]):
+                    results[key] = resp
+                else:
+                    errors[key] = f"no candles in {resp=}"
+            except Exception as e:
+                errors[key] = str(e)
+    for key, error in errors.items():
+        logging.warning(f"{key} {error} while getting many candles")
+    return results, errors
+
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+
+@lru_cache(maxsize=4096)
+def _epoch(timestamp) -> int:
+    """
+    epoch of what the broker sends, "2024-10-11T09:15:00+05:30", or of
+    a time it is asked for, "2024-10-11 09:15" in exchange time
+    """
+    try:
+        dt = datetime.fromisoformat(str(timestamp))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=IST)
+        return int(dt.timestamp())
+    except ValueError:
+        return 0
+
+
+class Candles:
+    """
+    candles as one int64 epoch column and float64 price columns, built
+    once when fetched, indexing a row gives (ts, o, h, l, c, v) like
+    the broker's lists did
+    """
+
+    __slots__ = ["ts", "o", "h", "l", "c", "v", "stops"]
+
+    def __init__(self, ts, o, h, l, c, v):
+        self.ts, self.o, self.h, self.l, self.c, self.v = ts, o, h, l, c, v
+        # (buy stop, high, sell stop, low) once computed by fill_stops
+        self.stops = None
+
+    @classmethod
+    def from_rows(cls, rows) -> "Candles":
+        if isinstance(rows, Candles):
+            return rows
+        if rows is None or not any(rows):
+            return cls(*[np.empty(0, dtype=np.int64)] + [np.empty(0)] * 5)
+        ts = np.fromiter((_epoch(row[0]) for row in rows), dtype=np.int64)
+        prices = np.array([row[1:6] for row in rows], dtype=np.float64)
+        return cls(ts, *prices.T)
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __getitem__(self, idx):
+        cols = self.__slots__[:6]
+        if isinstance(idx, slice):
+            return Candles(*(getattr(self, col)[idx] for col in cols))
+        return tuple(getattr(self, col)[idx] for col in cols)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __repr__(self):
+        cols = [getattr(self, col).tolist() for col in self.__slots__[:6]]
+        return f"Candles({list(zip(*cols))})"
+
+
+def lookback() -> int:
+    """closed candles the stops look back over, stop_lookback in settings"""
+    return O_SETG.get("stop_lookback", 2)
+
+
+def prior_high(candles_data, n=None) -> float:
+    """highest high of the n closed candles before the forming one"""
+    n = n or lookback()
+    return float(np.max(Candles.from_rows(candles_data).h[-1 - n : -1]))
+
+
+def prior_low(candles_data, n=None) -> float:
+    """lowest low of the n closed candles before the forming one"""
+    n = n or lookback()
+    return float(np.min(Candles.from_rows(candles_data).l[-1 - n : -1]))
+
+
+def _nan_to_none(value):
+    return None if np.isnan(value) else value
+
+
+def stack_candles(lst_of_candles: list) -> tuple[np.ndarray, np.ndarray]:
+    """highs and lows as (symbols x bars) matrices, short rows padded with nan"""
+    width = max((len(c) for c in lst_of_candles), default=0)
+    highs = np.full((len(lst_of_candles), width), np.nan)
+    lows = np.full((len(lst_of_candles), width), np.nan)
+    for row, candles in enumerate(lst_of_candles):
+        highs[row, : len(candles)] = candles.h
+        lows[row, : len(candles)] = candles.l
+    return highs, lows
+
+
+def find_stops(highs: np.ndarray, lows: np.ndarray, lookback=2) -> dict:
+    """
+    find_buy_stop and find_sell_stop for every row in one pass
+
+    Args:
+        highs, lows: (symbols x bars) arrays, padded with nan at the end
+
+    Returns:
+        dict of arrays with one value per symbol for buy_stop, high,
+        sell_stop and low, stops are nan when the extreme is in the
+        first `lookback` bars
+    """
+    rows = np.arange(highs.shape[0])[:, None]
+    back = np.arange(lookback, 0, -1)
+
+    hi_idx = np.argmax(np.where(np.isnan(highs), -np.inf, highs), axis=1)
+    lo_idx = np.argmin(np.where(np.isnan(lows), np.inf, lows), axis=1)
+
+    # the `lookback` bars just before each extreme
+    before_hi = np.clip(hi_idx[:, None] - back, 0, None)
+    before_lo = np.clip(lo_idx[:, None] - back, 0, None)
+
+    buy_stop = np.min(lows[rows, before_hi], axis=1)
+    sell_stop = np.max(highs[rows, before_lo], axis=1)
+    return dict(
+        buy_stop=np.where(hi_idx >= lookback, buy_stop, np.nan),
+        high=highs[rows[:, 0], hi_idx],
+        sell_stop=np.where(lo_idx >= lookback, sell_stop, np.nan),
+        low=lows[rows[:, 0], lo_idx],
+    )
+
+
+def fill_stops(lst_of_candles: list):
+    """
+    compute stops of many Candles at once, find_buy_stop and
+    find_sell_stop then just read the row stored on each of them
+    """
+    lst_of_candles = [c for c in lst_of_candles if len(c) > 0]
+    if not any(lst_of_candles):
+        return
+    stops = find_stops(*stack_candles(lst_of_candles), lookback())
+    for row, candles in enumerate(lst_of_candles):
+        candles.stops = (
+            _nan_to_none(stops["buy_stop"][row]),
+            stops["high"][row],
+            _nan_to_none(stops["sell_stop"][row]),
+            stops["low"][row],
+        )
+
+
+def carry_stops(old: Candles, new: Candles):
+    """
+    stops filled on old still hold for new, the same key refetched,
+    when the bars old had are unchanged and those added make no new
+    high or low. the stops only look at bars before the extremes
+    """
+    rows = len(old)
+    if old.stops is None or rows == 0 or len(new) < rows:
+        return
+    # only the last bar held can be replaced by a refetch
+    last = rows - 1
+    if (new.ts[last], new.h[last], new.l[last]) != (
+        old.ts[last],
+        old.h[last],
+        old.l[last],
+    ):
+        return
+    if len(new) > rows and (
+        new.h[rows:].max() > old.stops[1] or new.l[rows:].min() < old.stops[3]
+    ):
+        return
+    new.stops = old.stops
+
 
-    # Convert the "High" and "Low" columns to float
-    highs = np_data[:, 2].astype(float)
-    lows = np_data[:, 3].astype(float)
+def find_buy_stop(candles_data):
+    candles = Candles.from_rows(candles_data)
+    if candles.stops is not None:
+        return candles.stops[0], candles.stops[1]
+    highs, lows = candles.h, candles.l
 
     # Find the index of the highest value in the "High" column
     idx = np.argmax(highs)
@@ -37,9 +236,10 @@ def find_buy_stop(candles_data):
     # Find the highest value
     extreme = highs[idx]
 
-    # Handle edge case for idx < 2
-    if idx >= 2:
-        stop = np.min(lows[idx - 2 : idx])  # Take the two previous lows
+    # Handle edge case for idx < n
+    n = lookback()
+    if idx >= n:
+        stop = np.min(lows[idx - n : idx])  # Take the n previous lows
     else:
         stop = None
 
@@ -47,68 +247,83 @@ def find_buy_stop(candles_data):
 
 
 def find_sell_stop(candles_data):
-
-    np_data = np.array(candles_data)
-
-    # Convert the "High" and "Low" columns to float
-    highs = np_data[:, 2].astype(float)
-    lows = np_data[:, 3].astype(float)
+    candles = Candles.from_rows(candles_data)
+    if candles.stops is not None:
+        return candles.stops[2], candles.stops[3]
+    highs, lows = candles.h, candles.l
 
     idx = np.argmin(lows)
     extreme = lows[idx]
 
-    if idx >= 2:
-        stop = np.max(highs[idx - 2 : idx])
+    n = lookback()
+    if idx >= n:
+        stop = np.max(highs[idx - n : idx])
     else:
         stop = None
     return stop, extreme
 
 
 def find_extremes(candles_data):
-    np_data = np.array(candles_data)
-
-    # Extract the 'high' column, which is at index 2
-    high_values = np_data[:, 2].astype(float)
-    low_values = np_data[:, 3].astype(float)
+    candles = Candles.from_rows(candles_data)
 
     # Find the maximum of the 'high' column
-    max_high = np.max(high_values)
-    min_low = np.min(low_values)
+    max_high = np.max(candles.h)
+    min_low = np.min(candles.l)
 
     return min_low, max_high
 
 
-def rank(data, method):
-    """Ranks prices based on proximity to h/l and assigns a unified rank.
-
-    Args:
-        data (pd.DataFrame): DataFrame containing columns 'h', 'l', 'c'.
+def rank_arrays(h, l, c, method="both") -> tuple[np.ndarray, np.ndarray]:
+    """
+    rank and side of every symbol from its high, low and close
 
-    Returns:
-        pd.DataFrame: DataFrame with an additional 'rank' and 'action' column.
+    lower rank is closer to a breakout, closes already beyond the
+    level go below zero. side is the level the close is nearer to.
+    symbols without a range rank last.
     """
-    data["price_range"] = data["h"] - data["l"]
-    data["distance_from_l"] = (data["c"] - data["l"]) / data["price_range"]
-    data["distance_from_h"] = (data["h"] - data["c"]) / data["price_range"]
-    # data["rank"] = 0.5 - (data["c"] - data["l"]) / data["price_range"]
+    h, l, c = (np.asarray(x, dtype=np.float64) for x in (h, l, c))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        price_range = h - l
+        distance_from_l = (c - l) / price_range
+        distance_from_h = (h - c) / price_range
     if method == "low":
-        data["rank"] = data["distance_from_l"]
-        data.loc[data["c"] < data["l"], "rank"] = data["distance_from_l"] - 1
+        ranks = np.where(c < l, distance_from_l - 1, distance_from_l)
+        side = np.full(len(c), "sell")
     elif method == "high":
-        data["rank"] = data["distance_from_h"]
-        data.loc[data["c"] > data["h"], "rank"] = data["distance_from_h"] - 1
+        ranks = np.where(c > h, distance_from_h - 1, distance_from_h)
+        side = np.full(len(c), "buy")
     else:
         # iniitalize with high
-        data["rank"] = data["distance_from_h"]
-        data.loc[data["c"] > data["h"], "rank"] = data["distance_from_h"] - 1
-        data.loc[data["c"] < data["l"], "rank"] = data["distance_from_l"] - 1
-        data.loc[data["distance_from_l"] < data["distance_from_h"], "rank"] = data[
-            "distance_from_l"
-        ]
+        ranks = np.where(c > h, distance_from_h - 1, distance_from_h)
+        ranks = np.where(c < l, distance_from_l - 1, ranks)
+        nearer_low = distance_from_l < distance_from_h
+        ranks = np.where(nearer_low, distance_from_l, ranks)
+        side = np.where(nearer_low, "sell", "buy")
+    return np.where(np.isfinite(ranks), ranks, np.inf), side
+
+
+def top_k(ranks: np.ndarray, k=None) -> np.ndarray:
+    """indices of the k lowest ranks in rank order, all when k is None"""
+    if k is None or k >= len(ranks):
+        return np.argsort(ranks, kind="stable")
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    idx = np.argpartition(ranks, k - 1)[:k]
+    return idx[np.argsort(ranks[idx], kind="stable")]
+
+
+def rank(data, method="both"):
+    """Ranks prices based on proximity to h/l and assigns a unified rank.
+
+    Args:
+        data (pd.DataFrame): DataFrame containing columns 'h', 'l', 'c'.
 
-    data.sort_values(by=["rank"], inplace=True)
-    data = data.reset_index(drop=True)
-    return data
+    Returns:
+        pd.DataFrame: DataFrame with an additional 'rank' and 'side' column.
+    """
+    ranks, side = rank_arrays(data["h"], data["l"], data["c"], method)
+    data = data.assign(rank=ranks, side=side)
+    return data.iloc[top_k(ranks)].reset_index(drop=True)
 
 
 def format_candle_data(row: Any, data: list[list[Any]]) -> dict[str, Any]:
@@ -123,24 +338,29 @@ def format_candle_data(row: Any, data: list[list[Any]]) -> dict[str, Any]:
     }
 
 
+def _historic_param(row: Any, to: str) -> dict[str, Any]:
+    return {
+        "exchange": row["exchange"],
+        "symboltoken": row["token"],
+        "interval": "THIRTY_MINUTE",
+        "fromdate": dt_to_str("9:15"),
+        # "fromdate": "2024-10-11 9:15",
+        "todate": dt_to_str(to),
+        # "todate": "2024-10-11 15:15",
+    }
+
+
 def get_candles(df: Any, to="") -> dict[str, dict[str, Any]]:
     try:
         candles = {}
-
-        for _, row in df.iterrows():
-            historic_param = {
-                "exchange": row["exchange"],
-                "symboltoken": row["token"],
-                "interval": "THIRTY_MINUTE",
-                "fromdate": dt_to_str("9:15"),
-                # "fromdate": "2024-10-11 9:15",
-                "todate": dt_to_str(to),
-                # "todate": "2024-10-11 15:15",
-            }
-            resp = get_historical_data(historic_param)
-            # TODO
-            if resp is not None and any(resp) and any(resp[0]):
-                candles[row["symbol"]] = format_candle_data(row, resp[0])
+        rows = {row["symbol"]: row for _, row in df.iterrows()}
+        resp, _ = get_historical_many(
+            {sym: _historic_param(row, to) for sym, row in rows.items()}
+        )
+        # keep the universe order
+        for sym, row in rows.items():
+            if sym in resp:
+                candles[sym] = format_candle_data(row, resp[sym][0])
     except Exception as e:
         logging.error(f"{e} while getting candles")
         print_exc()
@@ -148,42 +368,53 @@ def get_candles(df: Any, to="") -> dict[str, dict[str, Any]]:
         return candles
 
 
-def _get_candle_lst(df: Any, to="") -> dict[str, dict[str, Any]]:
-    try:
-        lst = []
-        for _, row in df.iterrows():
-            historic_param = {
-                "exchange": row["exchange"],
-                "symboltoken": row["token"],
-                "interval": "THIRTY_MINUTE",
-                "fromdate": dt_to_str("9:15"),
-                # "fromdate": "2024-10-11 9:15",
-                "todate": dt_to_str(to),
-                # "todate": "2024-10-11 15:15",
-            }
-            resp = get_historical_data(historic_param)
-            # TODO
-            if resp is not None and any(resp) and any(resp[0]):
-                lst.append(format_candle_data(row, resp[0]))
-
-    except Exception as e:
-        logging.error(f"{e} while getting candles")
-        print_exc()
-    finally:
-        return lst
+def _get_candle_lst(df: Any, to="") -> list[dict[str, Any]]:
+    return list(get_candles(df, to).values())
 
 
-def get_candles_ranked(df, to, method="both"):
+def get_candles_ranked(df, to, method="both", k=None) -> dict[str, dict[str, Any]]:
+    """candles of the k best ranked symbols as plain dicts, best first"""
     candles = {}
     lst = _get_candle_lst(df, to)
     if any(lst):
-        data = pd.DataFrame(lst)
-        rank_data = _rank(data, method)
-        for _, row in rank_data.iterrows():
-            candles[row["tsym"]] = row
+        ranks, side = rank_arrays(
+            [dct["h"] for dct in lst],
+            [dct["l"] for dct in lst],
+            [dct["c"] for dct in lst],
+            method,
+        )
+        for i in top_k(ranks, k):
+            dct = dict(lst[i], rank=float(ranks[i]), side=str(side[i]))
+            candles[dct["tsym"]] = dct
     return candles
 
 
+def select_candles(
+    candles: dict, k=0, min_range_pct=0, max_range_pct=0
+) -> dict[str, dict[str, Any]]:
+    """
+    keep the best `k` ranked candidates (0 keeps all) whose h-l
+    range in percent of the close is within the given bounds
+    (a bound of 0 is not applied)
+    """
+    lst = list(candles.values())
+    if not any(lst):
+        return {}
+    h, l, c = (
+        np.array([dct[col] for dct in lst], dtype=np.float64) for col in "hlc"
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        range_pct = (h - l) / c * 100
+    ok = range_pct >= min_range_pct
+    if max_range_pct:
+        ok &= range_pct <= max_range_pct
+    ranks = np.array([dct.get("rank", 0) for dct in lst], dtype=np.float64)
+    ranks[~ok] = np.inf
+    selected = {lst[i]["tsym"]: lst[i] for i in top_k(ranks, k or None) if ok[i]}
+    logging.info(f"selected {len(selected)} of {len(lst)} candidates")
+    return selected
+
+
 # Test the find_buy_stop function
 if __name__ == "__main__":
     data = [
@@ -224,3 +455,4 @@ if __name__ == "__main__":
 
     resp = rank(data)
     print(resp)
+    print(top_k(rank_arrays(data["h"], data["l"], data["c"])[0], 2))
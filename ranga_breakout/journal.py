@@ -0,0 +1,221 @@
+from traceback import print_exc
+import atexit
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+
+import pendulum as pdlm
+
+from __init__ import logging, S_ACTIONS, TZ, json_default
+
+
+def day_path(path: str, day: str) -> str:
+    """the journal of one trading day, actions.jsonl -> actions_2024-10-11.jsonl"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{day}{ext}"
+
+
+def _day_of(ts: float) -> str:
+    return pdlm.from_timestamp(ts, tz=TZ).to_date_string()
+
+
+def _order_id(args: dict, resp):
+    """modify sends orderid, cancel sends order_id, place answers with it"""
+    order_id = args.get("orderid", args.get("order_id", None))
+    if order_id is None and isinstance(resp, str):
+        order_id = resp
+    return order_id
+
+
+class OrderJournal:
+    """
+    append only record of every order action. a request line is
+    queued before the call goes to the broker and a response line when
+    it returns, both carry the same run and seq, so processes that
+    share the data folder or restart never pair up each other's lines.
+    a writer thread drains the queue into the file of the trading day
+    and fsyncs once per batch so callers never wait on the disk.
+    """
+
+    def __init__(self, path=S_ACTIONS, flush_after=0.2, batch=256):
+        self.path = path
+        self.flush_after = flush_after
+        self.batch = batch
+        self.written = 0
+        # seq starts again at 1 in every process
+        self.run = f"{os.getpid()}-{int(time.time())}"
+        self._seq = itertools.count(1)
+        self._queue = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer, daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _put(self, dct):
+        # a journal without a path keeps nothing, e.g. in a backtest
+        if self.path is None:
+            return
+        self._start()
+        self._queue.put(dct)
+
+    def request(self, action: str, args: dict) -> int:
+        seq = next(self._seq)
+        self._put(
+            dict(
+                run=self.run,
+                seq=seq,
+                phase="request",
+                action=action,
+                args=args,
+                mono=time.monotonic(),
+                ts=time.time(),
+            )
+        )
+        return seq
+
+    def response(self, seq: int, future):
+        dct = dict(
+            run=self.run,
+            seq=seq,
+            phase="response",
+            mono=time.monotonic(),
+            ts=time.time(),
+        )
+        try:
+            dct["resp"] = future.result()
+        except Exception as e:
+            dct["error"] = str(e)
+        self._put(dct)
+
+    def _drain(self, first) -> list:
+        lines = [first]
+        while len(lines) < self.batch:
+            try:
+                lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return lines
+
+    def _writer(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_after)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+            try:
+                lines = self._drain(first)
+                by_day = {}
+                for dct in lines:
+                    by_day.setdefault(_day_of(dct["ts"]), []).append(dct)
+                for day, lst in by_day.items():
+                    with open(day_path(self.path, day), "a") as f:
+                        for dct in lst:
+                            f.write(json.dumps(dct, default=json_default) + "\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                self.written += len(lines)
+            except Exception as e:
+                logging.error(f"{e} while writing order journal")
+                print_exc()
+
+    def close(self):
+        """waits until everything queued is on disk"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def read_journal(path=S_ACTIONS) -> list:
+    lst = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    lst.append(json.loads(line))
+                except ValueError:
+                    # torn line at a crash
+                    continue
+    except FileNotFoundError:
+        pass
+    return lst
+
+
+def lifecycles(day="", path=S_ACTIONS) -> dict:
+    """
+    every order of the trading day, today by default, with its actions
+    in time order, each with the request args, the response and the
+    broker round trip
+    """
+    day = day or pdlm.today(tz=TZ).to_date_string()
+    requests, orders = {}, {}
+    for dct in read_journal(day_path(path, day)):
+        key = (dct.get("run", None), dct["seq"])
+        if dct["phase"] == "request":
+            requests[key] = dct
+            continue
+        req = requests.pop(key, None)
+        if req is None:
+            continue
+        resp = dct.get("resp", None)
+        order_id = _order_id(req["args"], resp)
+        event = dict(
+            action=req["action"],
+            ts=req["ts"],
+            args=req["args"],
+            resp=resp,
+            error=dct.get("error", None),
+            latency=round(dct["mono"] - req["mono"], 6),
+        )
+        orders.setdefault(order_id, []).append(event)
+    # requests that never got an answer, e.g. the process died
+    for req in requests.values():
+        order_id = _order_id(req["args"], None)
+        event = dict(action=req["action"], ts=req["ts"], args=req["args"], resp=None)
+        orders.setdefault(order_id, []).append(dict(event, error="no response"))
+    for events in orders.values():
+        events.sort(key=lambda event: event["ts"])
+    return orders
+
+
+O_JOURNAL = OrderJournal()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from concurrent.futures import Future
+
+    path = tempfile.mkdtemp() + "/actions.jsonl"
+    journal = OrderJournal(path)
+    # a run that died before its answer came, sharing seq 1 with this one
+    crashed = OrderJournal(path)
+    crashed.run = "0-0"
+    crashed.request("order_place", dict(symbol="INFY-EQ", quantity=1))
+    crashed.close()
+    started = time.perf_counter()
+    for i in range(1000):
+        future = Future()
+        seq = journal.request("order_place", dict(symbol="SBIN-EQ", quantity=1))
+        future.set_result(f"24{i:06d}")
+        journal.response(seq, future)
+        seq = journal.request("order_modify", dict(orderid=f"24{i:06d}", price=1))
+        future = Future()
+        future.set_exception(ValueError("rejected"))
+        journal.response(seq, future)
+    print(f"2000 actions queued in {time.perf_counter() - started:.4f}s")
+    journal.close()
+    started = time.perf_counter()
+    orders = lifecycles(path=path)
+    print(f"{len(orders)} orders rebuilt in {time.perf_counter() - started:.4f}s")
+    print(orders["24000001"])
+    print(orders[None])
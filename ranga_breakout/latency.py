@@ -0,0 +1,195 @@
+from traceback import print_exc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import atexit
+import json
+import threading
+import time
+
+from __init__ import logging, O_SETG, S_DATA
+
+S_LATENCY = S_DATA + "latency.jsonl"
+# 64 buckets per power of two, a percentile is off by under 1.6%
+SUB_BITS = 6
+LINEAR = 2 << SUB_BITS
+
+
+def _bucket(us: int) -> int:
+    if us < LINEAR:
+        return us
+    shift = us.bit_length() - SUB_BITS - 1
+    return (shift << SUB_BITS) + (us >> shift)
+
+
+def _lowest(idx: int) -> int:
+    """smallest microseconds that fall in the bucket"""
+    if idx < LINEAR:
+        return idx
+    shift = (idx >> SUB_BITS) - 1
+    return (idx - (shift << SUB_BITS)) << shift
+
+
+class Histogram:
+    """
+    durations in microseconds counted in log linear buckets like an
+    hdr histogram, constant memory and time however many are recorded
+    """
+
+    __slots__ = ["counts", "count", "total", "max"]
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, us: int):
+        idx = _bucket(us)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, p: float) -> int:
+        if self.count == 0:
+            return 0
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                return min(_lowest(idx + 1) - 1, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """milliseconds"""
+        return dict(
+            count=self.count,
+            mean=round(self.total / self.count / 1000, 3) if self.count else 0,
+            p50=self.percentile(50) / 1000,
+            p99=self.percentile(99) / 1000,
+            max=self.max / 1000,
+        )
+
+
+class Latency:
+    """
+    histograms of how long the labelled hot paths take. the summary of
+    every label goes to a json line each `every` seconds and at exit,
+    written by a thread of its own so no hot path waits on the file.
+
+    when disabled timed() hands back the function itself and timer()
+    a shared null context, so nothing is measured or paid for
+    """
+
+    def __init__(self, path=S_LATENCY, every=60, enabled=False):
+        self.path = path
+        self.every = every
+        self.enabled = enabled
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._null = nullcontext()
+        if enabled:
+            atexit.register(self.dump)
+            threading.Thread(target=self._dumper, daemon=True).start()
+
+    def _dumper(self):
+        while True:
+            time.sleep(self.every)
+            self.dump()
+
+    def record(self, label: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(label, None)
+            if histogram is None:
+                histogram = self.histograms[label] = Histogram()
+            histogram.record(int(seconds * 1_000_000))
+
+    @contextmanager
+    def _timer(self, label):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(label, time.perf_counter() - started)
+
+    def timer(self, label: str):
+        """with O_LATENCY.timer("label"): ..."""
+        if not self.enabled:
+            return self._null
+        return self._timer(label)
+
+    def timed(self, label=None):
+        """
+        decorator, the label defaults to the module and qualified name
+        of the function, breakout.py and strategy.py both have Breakout
+        """
+
+        def decorator(fn):
+            if not self.enabled:
+                return fn
+            name = label or f"{fn.__module__}.{fn.__qualname__}"
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - started)
+
+            return wrapper
+
+        return decorator
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {k: v.summary() for k, v in sorted(self.histograms.items())}
+
+    def dump(self):
+        # without a path nothing is kept, e.g. in a backtest
+        if self.path is None:
+            return
+        try:
+            summary = self.summary()
+            if not any(summary):
+                return
+            with open(self.path, "a") as f:
+                f.write(json.dumps(dict(ts=time.time(), latency=summary)) + "\n")
+        except Exception as e:
+            logging.error(f"{e} while dumping latency")
+            print_exc()
+
+
+O_LATENCY = Latency(
+    every=O_SETG.get("latency_every", 60), enabled=O_SETG.get("latency", False)
+)
+timed = O_LATENCY.timed
+
+
+if __name__ == "__main__":
+    import random
+
+    latency = Latency(path=None, enabled=True)
+
+    @latency.timed("sleep")
+    def nap(seconds):
+        time.sleep(seconds)
+
+    for _ in range(200):
+        nap(random.expovariate(1000))
+    for _ in range(100_000):
+        with latency.timer("empty"):
+            pass
+    for label, summary in latency.summary().items():
+        print(label, summary)
+
+    off = Latency(enabled=False)
+    started = time.perf_counter()
+    for _ in range(100_000):
+        with off.timer("empty"):
+            pass
+    print(f"disabled timer {(time.perf_counter() - started) * 10:.3f}us per call")
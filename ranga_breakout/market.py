@@ -0,0 +1,57 @@
+from api import Helper
+from latency import timed
+from orderbook import OrderBook
+from feed import TickFeed, OrderFeed
+import threading
+
+# held while a strategy runs or the order book is
+# being updated, so they never interleave
+O_LOCK = threading.RLock()
+O_BOOK = OrderBook()
+O_FEED = TickFeed()
+O_ORDERS = OrderFeed(O_BOOK, lock=O_LOCK)
+
+
+def exch_token(params):
+    try:
+        lst = [v for v in params.values()]
+        exch = lst[0]["exchange"]
+        lst_of_tokens = [dct["token"] for dct in lst]
+        return exch, lst_of_tokens
+    except Exception as e:
+        print(e)
+
+
+@timed()
+def get_ltp(params: dict) -> dict:
+    new_dct = {}
+    try:
+        exch, lst_of_tokens = exch_token(params)
+    except Exception as e:
+        print(f"Error while getting LTP: {e}")
+        return new_dct
+
+    # Batch the tokens into chunks of 50
+    batch_size = 50
+    for i in range(0, len(lst_of_tokens), batch_size):
+        token_batch: list = lst_of_tokens[i : i + batch_size]
+        exch_token_dict = {exch: token_batch}
+        try:
+            # Fetch LTP for the current batch, Helper paces the calls
+            resp = Helper.market_data("LTP", exch_token_dict)
+            lst_of_dict = resp["data"]["fetched"]
+
+            if isinstance(lst_of_dict, list):
+                # Update the dictionary with the current batch's LTPs
+                new_dct.update({dct["symbolToken"]: dct["ltp"] for dct in lst_of_dict})
+        except Exception as e:
+            # the other batches still count, this one is tried next cycle
+            print(f"Error while getting LTP of batch {i // batch_size}: {e}")
+    return new_dct
+
+
+def start_feed(params: dict):
+    """stream ltp of all params instead of polling them every cycle"""
+    exch, lst_of_tokens = exch_token(params)
+    O_FEED.subscribe(exch, lst_of_tokens)
+    O_FEED.start()
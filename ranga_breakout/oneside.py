@@ -1,12 +1,13 @@
 from traceback import print_exc
 from typing import Any  # Importing only the required types
 
-from toolkit.kokoo import dt_to_str
-
 from __init__ import logging
 from api import Helper
+from orderbook import OrderBook
 
-from history import find_buy_stop, get_historical_data, find_sell_stop
+from history import find_buy_stop, find_sell_stop
+from candles import O_CANDLES, candle_interval
+from latency import timed
 
 from pprint import pprint
 
@@ -42,7 +43,7 @@ class Oneside:
         self.dir = dir
 
         defaults = {
-            "fn": self.if_complete_place_stop,
+            "fn": self.place_entry,
             "buy_args": {},
             "sell_args": {},
             "buy_id": None,
@@ -58,8 +59,30 @@ class Oneside:
         self.message = "message not set"
         logging.info(self.dct)
         self.make_order_params()
-        getattr(self, f"_{dir}_trade")(self.dct)
 
+    def legs(self):
+        return [self.dir]
+
+    def legs_placed(self):
+        """the entry is in, placed now or found after a restart"""
+        self.dct["fn"] = self.if_complete_place_stop
+        self.message = f"{self.dir} order placed for {self.dct['tsym']}"
+
+    def place_entry(self):
+        """
+        sent on the first run and not when built, so the snapshot of
+        the strategy is on disk before its order goes out
+        """
+        try:
+            getattr(self, f"_{self.dir}_trade")(self.dct)
+            self.legs_placed()
+        except Exception as e:
+            self.message = f"{self.dct['tsym']} encountered {e} while placing entry"
+            logging.error(self.message)
+            print_exc()
+            self.dct["fn"] = None
+
+    @timed()
     def if_complete_place_stop(self):
         try:
             status = self._is_buy_or_sell(self.dir)
@@ -116,7 +139,7 @@ class Oneside:
 
     def _buy_trade(self, args):
         # Place buy order
-        resp = Helper.api.order_place(**args["buy_args"])
+        resp = Helper.order_place(**args["buy_args"])
         logging.debug(
             f"{args['buy_args']['symbol']} {args['buy_args']['side']} got {resp=}"
         )
@@ -125,7 +148,7 @@ class Oneside:
 
     def _sell_trade(self, args):
         # Place sell order
-        resp = Helper.api.order_place(**args["sell_args"])
+        resp = Helper.order_place(**args["sell_args"])
         logging.debug(
             f"{args['sell_args']['symbol']} {args['sell_args']['side']} got {resp=}"
         )
@@ -200,14 +223,9 @@ class Oneside:
     """
 
     def get_history(self):
-        params = {
-            "exchange": self.dct["exchange"],
-            "symboltoken": self.dct["token"],
-            "interval": "FIFTEEN_MINUTE",
-            "fromdate": dt_to_str("9:15"),
-            "todate": dt_to_str(""),
-        }
-        return get_historical_data(params)
+        return O_CANDLES.get(
+            self.dct["exchange"], self.dct["token"], candle_interval()
+        )
 
     def _is_modify_order(self, candles_now):
         try:
@@ -250,6 +268,7 @@ class Oneside:
             logging.error(self.message)
             print_exc()
 
+    @timed()
     def trail_stoploss(self):
         """
         if candles  count is changed and then check ltp
@@ -297,7 +316,7 @@ class Oneside:
                     """
                     if any(args):
                         logging.debug(f"order modify {args}")
-                        resp = Helper.api.order_modify(**args)
+                        resp = Helper.order_modify(**args)
                         logging.debug(f"order modify {resp}")
                         self.candle_count = len(candles_now)
                         self.candle_other = len(candles_now)
@@ -309,12 +328,15 @@ class Oneside:
             logging.error(self.message)
             print_exc()
 
+    @timed()
     def run(self, lst_of_orders, dct_of_ltp, CANDLE_OTHER):
         try:
             if isinstance(lst_of_orders, list):
                 self.dct_of_orders = {
                     dct["orderid"]: dct for dct in lst_of_orders if "orderid" in dct
                 }
+            elif isinstance(lst_of_orders, OrderBook):
+                self.dct_of_orders = lst_of_orders.by_id
             self.dct["last_price"] = dct_of_ltp.get(
                 self.dct["token"], self.dct["last_price"]
             )
@@ -344,7 +366,7 @@ class Oneside:
 
 
 if __name__ == "__main__":
-    from main import get_ltp
+    from market import get_ltp
     from universe import stocks_in_play
     from history import get_candles
 
@@ -0,0 +1,71 @@
+from __init__ import logging
+import threading
+
+# fields that change during an order's life, a row is re-indexed
+# only when one of them differs from what we already hold
+VERSION_KEYS = ["status", "updatetime", "filledshares", "price", "triggerprice"]
+# once an order reaches one of these it never goes back
+TERMINAL = ["complete", "rejected", "cancelled"]
+
+
+class OrderBook:
+    """
+    single index of the broker order book shared by all strategies
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_token = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def update_one(self, order: dict) -> bool:
+        """index one order, returns True if it is new or changed"""
+        order_id = order.get("orderid", None)
+        if order_id is None:
+            return False
+        version = tuple(order.get(key, None) for key in VERSION_KEYS)
+        with self._lock:
+            if self._versions.get(order_id, None) == version:
+                return False
+            old = self.by_id.get(order_id, None)
+            if old is not None:
+                if (
+                    old.get("status") in TERMINAL
+                    and order.get("status") not in TERMINAL
+                ):
+                    # a polled book older than a streamed update
+                    return False
+                self._versions[order_id] = version
+                # keep the same dict so references held elsewhere stay valid
+                old.update(order)
+            else:
+                self._versions[order_id] = version
+                self.by_id[order_id] = dict(order)
+                token = order.get("symboltoken", None)
+                self.by_token.setdefault(token, {})[order_id] = self.by_id[order_id]
+            return True
+
+    def update(self, lst_of_orders) -> list:
+        """index a fresh order book, returns ids of orders that changed"""
+        changed = []
+        try:
+            if isinstance(lst_of_orders, list):
+                changed = [
+                    order["orderid"]
+                    for order in lst_of_orders
+                    if self.update_one(order)
+                ]
+        except Exception as e:
+            logging.error(f"{e} while updating order book")
+        finally:
+            return changed
+
+    def get(self, order_id, default=None):
+        return self.by_id.get(order_id, default)
+
+    def orders_for(self, token) -> dict:
+        return self.by_token.get(token, {})
+
+    def __len__(self):
+        return len(self.by_id)
@@ -0,0 +1,188 @@
+from traceback import print_exc
+import json
+import random
+import time
+
+import numpy as np
+import pendulum as pdlm
+
+from __init__ import logging, TZ
+from api import LIMITS
+from ratelimit import TokenBucket
+from history import Candles
+from simbroker import SimBroker, _Obj, random_day, tick_path
+
+
+class _PaperObj(_Obj):
+
+    def getCandleData(self, historic_param):
+        return self.broker._call("candle", super().getCandleData, historic_param)
+
+    def getMarketData(self, mode, exch_token_dict):
+        # a token first seen here gets its walk before the prices are read
+        for tokens in exch_token_dict.values():
+            for token in tokens:
+                self.broker._token(token)
+        return self.broker._call("ltp", super().getMarketData, mode, exch_token_dict)
+
+
+class PaperBroker(SimBroker):
+    """
+    SimBroker on the wall clock for paper trading and load tests. every
+    call waits a random round trip and is refused like the real api
+    when its endpoint goes over the per second limit.
+
+    minutes of a recorded day are moved to today, tokens without data
+    get a random walk when first asked for, so any universe can run.
+    """
+
+    def __init__(
+        self, minutes=None, latency=0.05, jitter=0.02, limits=LIMITS, seed=0
+    ):
+        super().__init__({})
+        self.obj = _PaperObj(self)
+        self.latency = latency
+        self.jitter = jitter
+        self.refused = 0
+        self.calls = 0
+        self._buckets = {k: TokenBucket(rate=v, per=1) for k, v in limits.items()}
+        self._random = random.Random(seed)
+        self._today = pdlm.today(tz=TZ).to_date_string()
+        self._stepped = {}
+        for token, rows in (minutes or {}).items():
+            self._add(token, rows)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """the paper section of breakout.yml"""
+        minutes = {}
+        if config.get("data", None):
+            with open(config["data"]) as f:
+                minutes = json.load(f)
+        return cls(
+            minutes,
+            latency=config.get("latency", 0.05),
+            jitter=config.get("jitter", 0.02),
+        )
+
+    def _add(self, token, rows):
+        candles = Candles.from_rows(rows)
+        if len(candles) > 0:
+            # the recorded day is replayed as if it were today
+            shift = (
+                pdlm.parse(self._today, tz=TZ).int_timestamp
+                - pdlm.from_timestamp(int(candles.ts[0]), tz=TZ)
+                .start_of("day")
+                .int_timestamp
+            )
+            candles.ts += shift
+        self.minutes[token] = candles
+        self._stepped[token] = 0
+
+    def _token(self, token):
+        token = str(token)
+        if token not in self.minutes:
+            seed = int(token) if token.isdigit() else hash(token)
+            rows = random_day([token], self._today, seed)[token]
+            self._add(token, rows)
+        return token
+
+    def _advance(self):
+        """trade every token through the minutes that closed since last time"""
+        self.now = int(time.time())
+        for token, candles in self.minutes.items():
+            end = np.searchsorted(candles.ts, self.now - 59, side="left")
+            for i in range(self._stepped[token], end):
+                for price in tick_path(
+                    candles.o[i], candles.h[i], candles.l[i], candles.c[i]
+                ):
+                    self.on_tick(token, float(price))
+            self._stepped[token] = max(self._stepped[token], end)
+
+    def _call(self, endpoint, fn, *args, **kwargs):
+        time.sleep(max(0.0, self._random.gauss(self.latency, self.jitter)))
+        with self._lock:
+            self.calls += 1
+            if not self._buckets[endpoint].try_acquire():
+                self.refused += 1
+                raise Exception("Access denied because of exceeding access rate")
+            self._advance()
+            return fn(*args, **kwargs)
+
+    def candles(self, historic_param) -> list:
+        self._token(historic_param["symboltoken"])
+        return super().candles(historic_param)
+
+    def order_place(self, **kwargs):
+        self._token(kwargs.get("symboltoken", kwargs.get("token")))
+        return self._call("order_place", super().order_place, **kwargs)
+
+    def order_modify(self, **kwargs):
+        return self._call("order_modify", super().order_modify, **kwargs)
+
+    def order_cancel(self, **kwargs):
+        return self._call("order_cancel", super().order_cancel, **kwargs)
+
+    @property
+    def orders(self):
+        return self._call("orders", lambda: SimBroker.orders.fget(self))
+
+    @property
+    def positions(self):
+        return self._call("positions", lambda: SimBroker.positions.fget(self))
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    from api import Helper
+    from history import get_historical_many
+    from market import get_ltp
+
+    Helper.ao = PaperBroker()
+    tokens = [str(1000 + i) for i in range(1000)]
+    params = {t: dict(exchange="NSE", token=t) for t in tokens}
+    try:
+        started = time.perf_counter()
+        ltp = get_ltp(params)
+        print(f"{len(ltp)} ltp in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        historic = {
+            t: dict(
+                exchange="NSE",
+                symboltoken=t,
+                interval="FIFTEEN_MINUTE",
+                fromdate=pdlm.today(tz=TZ).format("YYYY-MM-DD") + " 09:15",
+                todate=pdlm.now(tz=TZ).format("YYYY-MM-DD HH:mm"),
+            )
+            for t in tokens[:9]
+        }
+        resp, errors = get_historical_many(historic)
+        print(f"{len(resp)} candles in {time.perf_counter() - started:.2f}s")
+
+        args = dict(
+            symbol="SBIN-EQ",
+            exchange="NSE",
+            order_type="STOPLOSS_MARKET",
+            symboltoken="1000",
+            side="BUY",
+            quantity=1,
+            price=1000,
+            trigger_price=1000,
+        )
+
+        def place(_):
+            try:
+                return Helper.order_place(**args)
+            except Exception as e:
+                return str(e)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            ids = list(pool.map(place, range(100)))
+        print(f"{len(ids)} orders in {time.perf_counter() - started:.2f}s")
+        print(Helper.stats()["order_place"], f"{Helper.ao.refused=}")
+    except Exception as e:
+        logging.error(e)
+        print_exc()
@@ -0,0 +1,184 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    allows `rate` calls per `per` seconds with bursts up to `capacity`,
+    acquire blocks the calling thread until a token is available
+    """
+
+    def __init__(self, rate: float, per: float = 1.0, capacity: float = None):
+        self.rate = rate / per
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last) * self.rate
+        )
+        self._last = now
+
+    def wait_time(self) -> float:
+        """seconds until the next token, 0 if one is available now"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self) -> float:
+        """take a token, returns the seconds spent waiting for it"""
+        waited = 0.0
+        while not self.try_acquire():
+            delay = self.wait_time()
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+
+class Scheduler:
+    """
+    queues broker calls per endpoint and dispatches them as soon as the
+    endpoint has a token, endpoints with lower priority number go first.
+
+    limits are what the broker allows per second. buckets refill at
+    `headroom` of that and burst only the rest, so no one second
+    window goes over the limit however the calls bunch up
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, float],
+        priority: dict[str, int],
+        max_workers=8,
+        headroom=0.8,
+    ):
+        self._buckets = {
+            k: TokenBucket(
+                rate=v * headroom, per=1, capacity=max(1, v * (1 - headroom))
+            )
+            for k, v in limits.items()
+        }
+        self._order = sorted(limits, key=lambda k: priority.get(k, len(limits)))
+        self._queues = {k: deque() for k in limits}
+        self._stats = {
+            k: dict(calls=0, waited=0.0, max_wait=0.0, errors=0) for k in limits
+        }
+        self._stats_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch, daemon=True)
+            self._thread.start()
+
+    def submit(self, endpoint: str, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self._cond:
+            self._start()
+            self._queues[endpoint].append(
+                (time.monotonic(), future, fn, args, kwargs)
+            )
+            self._cond.notify()
+        return future
+
+    def call(self, endpoint: str, fn, *args, **kwargs):
+        """submit and block for the result, raises what fn raised"""
+        return self.submit(endpoint, fn, *args, **kwargs).result()
+
+    def _run(self, endpoint, future, fn, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            with self._stats_lock:
+                self._stats[endpoint]["errors"] += 1
+            future.set_exception(e)
+
+    def _next_job(self):
+        """pick the first runnable job in priority order, or the time to wait"""
+        delay = None
+        for endpoint in self._order:
+            if not self._queues[endpoint]:
+                continue
+            bucket = self._buckets[endpoint]
+            if bucket.try_acquire():
+                return endpoint, self._queues[endpoint].popleft(), 0
+            wait = bucket.wait_time()
+            delay = wait if delay is None else min(delay, wait)
+        return None, None, delay
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                endpoint, job, delay = self._next_job()
+                if job is None:
+                    self._cond.wait(timeout=delay)
+                    continue
+            queued_at, future, fn, args, kwargs = job
+            waited = time.monotonic() - queued_at
+            with self._stats_lock:
+                stat = self._stats[endpoint]
+                stat["calls"] += 1
+                stat["waited"] += waited
+                stat["max_wait"] = max(stat["max_wait"], waited)
+            self._pool.submit(self._run, endpoint, future, fn, args, kwargs)
+
+    def stats(self) -> dict[str, dict]:
+        """queue depth and wait times in seconds by endpoint"""
+        with self._cond, self._stats_lock:
+            return {
+                k: dict(
+                    v,
+                    queued=len(self._queues[k]),
+                    avg_wait=v["waited"] / v["calls"] if v["calls"] else 0.0,
+                )
+                for k, v in self._stats.items()
+            }
+
+
+class Inline(Scheduler):
+    """
+    same interface as Scheduler but runs every call at once on the
+    calling thread, for a simulated broker that needs no pacing
+    """
+
+    def __init__(self, limits: dict[str, float], priority=None):
+        self._stats = {
+            k: dict(calls=0, waited=0.0, max_wait=0.0, errors=0) for k in limits
+        }
+        self._queues = {k: deque() for k in limits}
+        self._stats_lock = threading.Lock()
+        self._cond = threading.Condition()
+
+    def submit(self, endpoint: str, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self._stats_lock:
+            self._stats[endpoint]["calls"] += 1
+        self._run(endpoint, future, fn, args, kwargs)
+        return future
+
+
+if __name__ == "__main__":
+    bucket = TokenBucket(rate=3, per=1)
+    start = time.monotonic()
+    for i in range(9):
+        bucket.acquire()
+        print(i, round(time.monotonic() - start, 2))
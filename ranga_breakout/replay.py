@@ -0,0 +1,176 @@
+# minimal local websocket server that replays recorded frames,
+# stands in for the angel one streams while testing the feeds
+from base64 import b64encode
+from hashlib import sha1
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def encode_frame(payload, opcode=None) -> bytes:
+    """server frames are never masked"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+        opcode = OP_TEXT if opcode is None else opcode
+    opcode = OP_BINARY if opcode is None else opcode
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + struct.pack(">H", length)
+    else:
+        header += bytes([127]) + struct.pack(">Q", length)
+    return header + payload
+
+
+def _read_exact(rfile, size):
+    data = rfile.read(size)
+    if data is None or len(data) < size:
+        raise ConnectionError("client went away")
+    return data
+
+
+def decode_frame(rfile) -> tuple[int, bytes]:
+    """read one client frame, returns opcode and unmasked payload"""
+    first, second = _read_exact(rfile, 2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", _read_exact(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", _read_exact(rfile, 8))[0]
+    mask = _read_exact(rfile, 4) if second & 0x80 else b"\x00\x00\x00\x00"
+    data = _read_exact(rfile, length)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handshake(self):
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                break
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        accept = b64encode(
+            sha1((headers["sec-websocket-key"] + GUID).encode()).digest()
+        ).decode()
+        self.wfile.write(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            ).encode()
+        )
+        return headers
+
+    def send(self, payload, opcode=None):
+        with self.lock:
+            self.wfile.write(encode_frame(payload, opcode))
+
+    def listen(self):
+        """answers heartbeats and records what the client sends"""
+        try:
+            while not self.closed.is_set():
+                opcode, data = decode_frame(self.rfile)
+                if opcode == OP_CLOSE:
+                    break
+                elif opcode == OP_PING:
+                    self.send(data, OP_PONG)
+                elif data == b"ping":
+                    self.send("pong")
+                else:
+                    self.server.received.append(data.decode())
+                    self.subscribed.set()
+        except Exception:
+            pass
+        finally:
+            self.closed.set()
+
+    def handle(self):
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.subscribed = threading.Event()
+        self.server.headers.append(self.handshake())
+        self.server.connections += 1
+        threading.Thread(target=self.listen, daemon=True).start()
+        if self.server.wait_for_message:
+            self.subscribed.wait(timeout=5)
+        try:
+            sent = 0
+            for delay, payload in self.server.frames[self.server.position :]:
+                if self.closed.is_set():
+                    return
+                time.sleep(delay)
+                self.send(payload)
+                self.server.position += 1
+                sent += 1
+                if self.server.drop_after and sent >= self.server.drop_after:
+                    # simulate a broken connection, the rest is sent on reconnect
+                    return
+            self.closed.wait(timeout=self.server.linger)
+        except Exception:
+            pass
+        finally:
+            self.closed.set()
+            # unblocks the listener so the connection really goes away
+            try:
+                self.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class ReplayServer(socketserver.ThreadingTCPServer):
+    """
+    sends `frames`, a list of (delay, payload) with payload as bytes
+    for binary frames or str for text, to each client in turn.
+
+    wait_for_message holds the replay until the client sends something
+    (e.g. a subscription), drop_after closes the connection after that
+    many frames so reconnect logic can be exercised.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        frames,
+        host="127.0.0.1",
+        port=0,
+        wait_for_message=False,
+        drop_after=0,
+        linger=1.0,
+    ):
+        super().__init__((host, port), _Handler)
+        self.frames = list(frames)
+        self.wait_for_message = wait_for_message
+        self.drop_after = drop_after
+        self.linger = linger
+        self.position = 0
+        self.connections = 0
+        self.received = []
+        self.headers = []
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"ws://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -1,12 +1,14 @@
 from traceback import print_exc
 from typing import Any  # Importing only the required types
-import numpy as np
-from toolkit.kokoo import dt_to_str
 
 from __init__ import logging, O_SETG
 from api import Helper
+from orderbook import OrderBook
 
-from history import find_buy_stop, get_historical_data, find_sell_stop, find_extremes
+from history import find_buy_stop, find_sell_stop, find_extremes
+from history import lookback, prior_high, prior_low
+from candles import O_CANDLES, candle_interval
+from latency import timed
 
 from pprint import pprint
 import pendulum as pdlm
@@ -77,16 +79,9 @@ class Reverse:
             candles_now = []
             if is_check:
                 self.next_check = pdlm.now().add(minutes=2)
-                params = {
-                    "exchange": self.dct["exchange"],
-                    "symboltoken": self.dct["token"],
-                    "interval": "FIFTEEN_MINUTE",
-                    "fromdate": dt_to_str("9:15"),
-                    "todate": dt_to_str(to),
-                }
-                candles_now = get_historical_data(params)
-                if candles_now is None:
-                    candles_now = []
+                candles_now = O_CANDLES.get(
+                    self.dct["exchange"], self.dct["token"], candle_interval(), to
+                )
         except Exception as e:
             self.message = f"{self.dct['tsym']} encountered {e} while get history"
             logging.error(self.message)
@@ -133,7 +128,7 @@ class Reverse:
             )
             args = self.dct[args_dict]
             logging.info(f"order modify: {args}")
-            resp = Helper.api.order_modify(**args)
+            resp = Helper.order_modify(**args)
             logging.info(f"order modify response: {resp}")
             self.dct["stop_price"] = stop_now
         except Exception as e:
@@ -179,10 +174,18 @@ class Reverse:
     def _place_order(self, order_args_key, order_type):
         """Helper to place an order and log the response."""
         args = self.dct[order_args_key]
-        resp = Helper.api.order_place(**args)
+        resp = Helper.order_place(**args)
         logging.debug(f"{args['symbol']} {order_type} order response: {resp}")
         return resp
 
+    def legs(self):
+        return ["buy", "sell"]
+
+    def legs_placed(self):
+        """both orders went in through bulk.place_initial_orders"""
+        self.dct["fn"] = self.move_initial_stop
+        self.message = f"buy and sell orders placed for {self.dct['tsym']}"
+
     def place_both_orders(self):
         try:
             # Place buy and sell orders with helper function
@@ -193,10 +196,9 @@ class Reverse:
                 if order_id and len(order_id) > 0:
                     self.dct["sell_id"] = order_id
                     # Set the next function
-                    self.dct["fn"] = self.move_initial_stop
-                    self.message = f"buy and sell orders placed for {self.dct['tsym']}"
+                    self.legs_placed()
                 else:
-                    Helper.api.order_cancel(
+                    Helper.order_cancel(
                         order_id=self.dct["buy_id"], variety="NORMAL"
                     )
                     logging.warning(
@@ -220,6 +222,7 @@ class Reverse:
       1.  move initial stop 
     """
 
+    @timed()
     def move_initial_stop(self):
         try:
             distance = float_2_curr(
@@ -253,16 +256,12 @@ class Reverse:
                         # Get candles and set trailing condition
                         candles_now = self._get_history()
                         if entry_type == "buy":
-                            self.dct["candle_two"] = max(
-                                candles_now[-3][2], candles_now[-2][2]
-                            )
+                            self.dct["candle_two"] = prior_high(candles_now)
                             self.dct["can_trail"] = (
                                 lambda c: c["last_price"] > c["candle_two"]
                             )
                         else:
-                            self.dct["candle_two"] = min(
-                                candles_now[-3][3], candles_now[-2][3]
-                            )
+                            self.dct["candle_two"] = prior_low(candles_now)
                             self.dct["can_trail"] = (
                                 lambda c: c["last_price"] < c["candle_two"]
                             )
@@ -294,9 +293,8 @@ class Reverse:
             if not any(candles_now):
                 candles_now = self._get_history()
 
-            arr_candles = np.array(candles_now)
-            if arr_candles.shape[0] >= 3:
-                self.candle_start = arr_candles.shape[0] - 3
+            if len(candles_now) >= lookback() + 1:
+                self.candle_start = len(candles_now) - lookback() - 1
 
                 self.dct["l"], self.dct["h"] = find_extremes(
                     candles_now[self.candle_start :]
@@ -305,14 +303,14 @@ class Reverse:
 
                 if self.dct["entry"] == "buy":
                     stop_now, order_id, args_dict = (
-                        min(candles_now[-3][3], candles_now[-2][3]),
+                        prior_low(candles_now),
                         "sell_id",
                         "sell_args",
                     )
                     self.dct["can_trail"] = lambda c: c["last_price"] > c["h"]
                 else:
                     stop_now, order_id, args_dict = (
-                        max(candles_now[-3][2], candles_now[-2][2]),
+                        prior_high(candles_now),
                         "buy_id",
                         "buy_args",
                     )
@@ -329,6 +327,7 @@ class Reverse:
             logging.error(f"{self.dct['tsym']} {e} while SETTING trailing stoploss")
             print_exc()
 
+    @timed()
     def move_breakeven(self):
         try:
             # Determine operation type based on entry
@@ -342,11 +341,11 @@ class Reverse:
             candles_now = self._get_history(pdlm.now() > self.next_check)
             if candles_now is not None and any(candles_now):
                 if operation == "sell":  # stop order is sell
-                    temp = max(candles_now[-3][2], candles_now[-2][2])
+                    temp = prior_high(candles_now)
                     if temp < self.dct["candle_two"]:
                         self.dct["candle_two"] = temp
                 else:  # stop order is buy
-                    temp = min(candles_now[-3][3], candles_now[-2][3])
+                    temp = prior_low(candles_now)
                     if temp > self.dct["candle_two"]:
                         self.dct["candle_two"] = temp
 
@@ -443,6 +442,7 @@ class Reverse:
         finally:
             return args
 
+    @timed()
     def trail_stoploss(self):
         """
         if candles  count is changed and then check ltp
@@ -466,7 +466,7 @@ class Reverse:
                     args = self._is_trailable(candles_now)
                     if any(args):
                         logging.debug(f"trailing stop modification parameters: {args}")
-                        resp = Helper.api.order_modify(**args)
+                        resp = Helper.order_modify(**args)
                         logging.debug(f"trailing stop  modification response: {resp}")
                         self.candle_count = len(candles_now)
                         # self.dct["l"], self.dct["h"] = find_extremes(candles_now)
@@ -479,12 +479,15 @@ class Reverse:
             logging.error(self.message)
             print_exc()
 
+    @timed()
     def run(self, lst_of_orders, dct_of_ltp, CANDLE_OTHER):
         try:
             if isinstance(lst_of_orders, list):
                 self.dct_of_orders = {
                     dct["orderid"]: dct for dct in lst_of_orders if "orderid" in dct
                 }
+            elif isinstance(lst_of_orders, OrderBook):
+                self.dct_of_orders = lst_of_orders.by_id
             self.dct["last_price"] = dct_of_ltp.get(
                 self.dct["token"], self.dct["last_price"]
             )
@@ -510,7 +513,7 @@ class Reverse:
 
 
 if __name__ == "__main__":
-    from main import get_ltp
+    from market import get_ltp
     from universe import stocks_in_play
     from history import get_candles
 
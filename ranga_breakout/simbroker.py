@@ -0,0 +1,355 @@
+from datetime import datetime
+from functools import lru_cache
+import itertools
+import threading
+
+import numpy as np
+import pendulum as pdlm
+
+from __init__ import SESSION_OPEN, TZ
+from history import IST, Candles, _epoch
+from candles import MINUTES
+
+STOPS = ["STOPLOSS_MARKET", "STOPLOSS_LIMIT"]
+
+
+def _first(kwargs, *keys, default=None):
+    """omspy and angel one spell the same order field differently"""
+    for key in keys:
+        if key in kwargs:
+            return kwargs[key]
+    return default
+
+
+@lru_cache(maxsize=4096)
+def _iso(epoch: int) -> str:
+    # what the broker sends, "2024-10-11T09:15:00+05:30"
+    return datetime.fromtimestamp(epoch, IST).isoformat()
+
+
+def tick_path(o, h, l, c) -> tuple:
+    """
+    prices a bar is taken to trade through, an up bar dips to its low
+    before making its high and a down bar rallies to its high first
+    """
+    if c >= o:
+        return (o, l, h, c)
+    return (o, h, l, c)
+
+
+def random_day(tokens: list, day="2024-10-11", seed=0) -> dict:
+    """a random walk of 1 minute candles by token, for trying things out"""
+    rng = np.random.default_rng(seed)
+    day_open = pdlm.parse(f"{day} 09:15", tz=TZ)
+    stamps = [day_open.add(minutes=i).to_iso8601_string() for i in range(375)]
+    minutes = {}
+    for token in tokens:
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, len(stamps))))
+        opens = np.r_[100, close[:-1]]
+        wick = np.abs(rng.normal(0, 0.0005, len(stamps))) * close
+        minutes[token] = [
+            [ts, o, max(o, c) + w, min(o, c) - w, c, 100]
+            for ts, o, c, w in zip(stamps, opens, close, wick)
+        ]
+    return minutes
+
+
+class _Obj:
+    """the smartapi calls of AngelOne.obj, answered from the loaded minutes"""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def getCandleData(self, historic_param):
+        return dict(status=True, data=self.broker.candles(historic_param))
+
+    def getMarketData(self, mode, exch_token_dict):
+        fetched = [
+            dict(symbolToken=token, ltp=self.broker.ltp[token])
+            for tokens in exch_token_dict.values()
+            for token in tokens
+            if token in self.broker.ltp
+        ]
+        return dict(status=True, data=dict(fetched=fetched, unfetched=[]))
+
+    def getfeedToken(self):
+        return "simulated"
+
+
+class SimBroker:
+    """
+    stands in for AngelOne behind api.Helper. the clock and prices come
+    from 1 minute candles by token, stop orders trigger and fill as
+    prices are stepped through with on_tick.
+
+    STOPLOSS_MARKET fills at the first price at or beyond the trigger,
+    STOPLOSS_LIMIT then waits until that price is within its limit.
+    """
+
+    def __init__(self, minutes: dict):
+        self.minutes = {k: Candles.from_rows(v) for k, v in minutes.items()}
+        self.obj = _Obj(self)
+        self.now = 0
+        self.ltp = {}
+        self.trades = []
+        self._orders = {}
+        self._pending = {}
+        self._positions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def authenticate(self):
+        return True
+
+    """
+        clock and prices
+    """
+
+    def _stamp(self) -> str:
+        return datetime.fromtimestamp(self.now, IST).strftime("%d-%b-%Y %H:%M:%S")
+
+    def on_tick(self, token, ltp):
+        with self._lock:
+            self.ltp[token] = ltp
+            for order in list(self._pending.get(token, {}).values()):
+                self._match(order, ltp)
+
+    def candles(self, historic_param) -> list:
+        """bars of the interval closed or forming at the broker clock"""
+        token = historic_param["symboltoken"]
+        candles = self.minutes.get(token, None)
+        if candles is None:
+            return []
+        interval = _interval_seconds(historic_param["interval"])
+        # only minutes that are over by now are known
+        end = np.searchsorted(candles.ts, self.now - 59, side="left")
+        ts = candles.ts[:end]
+        if len(ts) == 0:
+            return []
+        day_open = _day_open(ts[0])
+        buckets = day_open + (ts - day_open) // interval * interval
+        start = _epoch(historic_param["fromdate"])
+        upto = _epoch(historic_param["todate"])
+        keep = (buckets >= start) & (buckets <= upto)
+        if not keep.any():
+            return []
+        first, last = np.argmax(keep), len(keep) - np.argmax(keep[::-1])
+        buckets = buckets[first:last]
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(buckets)] - 1
+        rows = slice(first, last)
+        h = np.maximum.reduceat(candles.h[rows], starts)
+        l = np.minimum.reduceat(candles.l[rows], starts)
+        v = np.add.reduceat(candles.v[rows], starts)
+        return [
+            [
+                _iso(int(buckets[s])),
+                float(candles.o[first + s]),
+                float(h[i]),
+                float(l[i]),
+                float(candles.c[first + e]),
+                float(v[i]),
+            ]
+            for i, (s, e) in enumerate(zip(starts, ends))
+        ]
+
+    """
+        orders
+    """
+
+    def _fill(self, order, price):
+        order.update(
+            status="complete",
+            filledshares=str(order["quantity"]),
+            unfilledshares="0",
+            averageprice=price,
+            updatetime=self._stamp(),
+        )
+        self._pending.get(order["symboltoken"], {}).pop(order["orderid"], None)
+        qty = int(order["quantity"])
+        signed = qty if order["transactiontype"] == "BUY" else -qty
+        pos = self._positions.setdefault(
+            order["symboltoken"],
+            dict(
+                tradingsymbol=order["tradingsymbol"],
+                symboltoken=order["symboltoken"],
+                exchange=order["exchange"],
+                producttype=order["producttype"],
+                qty=0,
+                cash=0.0,
+            ),
+        )
+        pos["qty"] += signed
+        pos["cash"] -= signed * price
+        self.trades.append(
+            dict(
+                orderid=order["orderid"],
+                token=order["symboltoken"],
+                side=order["transactiontype"],
+                quantity=qty,
+                price=price,
+                ts=self.now,
+            )
+        )
+
+    def _crossed(self, order, ltp) -> bool:
+        if ltp is None:
+            return False
+        if order["transactiontype"] == "BUY":
+            return ltp >= float(order["triggerprice"])
+        return ltp <= float(order["triggerprice"])
+
+    def _match(self, order, ltp):
+        is_buy = order["transactiontype"] == "BUY"
+        if order["status"] == "trigger pending":
+            trigger = float(order["triggerprice"])
+            if (is_buy and ltp < trigger) or (not is_buy and ltp > trigger):
+                return
+            if order["ordertype"] == "STOPLOSS_MARKET":
+                return self._fill(order, ltp)
+            order.update(status="open", updatetime=self._stamp())
+        if order["ordertype"] == "MARKET":
+            return self._fill(order, ltp)
+        limit = float(order["price"])
+        if (is_buy and ltp <= limit) or (not is_buy and ltp >= limit):
+            # a marketable limit gets the better of the two
+            self._fill(order, min(ltp, limit) if is_buy else max(ltp, limit))
+
+    def order_place(self, **kwargs):
+        with self._lock:
+            order_id = f"SIM{next(self._ids):08d}"
+            order_type = _first(kwargs, "order_type", "ordertype", default="MARKET")
+            order = dict(
+                orderid=order_id,
+                tradingsymbol=_first(kwargs, "symbol", "tradingsymbol"),
+                symboltoken=str(_first(kwargs, "symboltoken", "token")),
+                exchange=kwargs.get("exchange", "NSE"),
+                transactiontype=_first(kwargs, "side", "transactiontype").upper(),
+                ordertype=order_type,
+                producttype=_first(
+                    kwargs, "product", "producttype", default="INTRADAY"
+                ),
+                variety=kwargs.get("variety", "NORMAL"),
+                quantity=str(kwargs.get("quantity", 0)),
+                price=float(kwargs.get("price", 0) or 0),
+                triggerprice=float(
+                    _first(kwargs, "trigger_price", "triggerprice", default=0) or 0
+                ),
+                filledshares="0",
+                status="trigger pending" if order_type in STOPS else "open",
+                updatetime=self._stamp(),
+            )
+            self._orders[order_id] = order
+            ltp = self.ltp.get(order["symboltoken"], None)
+            if order_type in STOPS and self._crossed(order, ltp):
+                # the exchange does not take a stop that would trigger at once
+                order.update(status="rejected", text="trigger price already crossed")
+                return order_id
+            self._pending.setdefault(order["symboltoken"], {})[order_id] = order
+            if ltp is not None:
+                self._match(order, ltp)
+            return order_id
+
+    def order_modify(self, **kwargs):
+        with self._lock:
+            order = self._orders[_first(kwargs, "orderid", "order_id")]
+            if order["status"] not in ["open", "trigger pending"]:
+                raise ValueError(f"cannot modify {order['status']} order")
+            modified = dict(
+                order,
+                price=float(kwargs.get("price", order["price"])),
+                triggerprice=float(
+                    _first(kwargs, "trigger_price", "triggerprice")
+                    or order["triggerprice"]
+                ),
+            )
+            ltp = self.ltp.get(order["symboltoken"], None)
+            if order["status"] == "trigger pending" and self._crossed(modified, ltp):
+                raise ValueError("trigger price already crossed")
+            order.update(
+                price=modified["price"],
+                triggerprice=modified["triggerprice"],
+                updatetime=self._stamp(),
+            )
+            if ltp is not None:
+                self._match(order, ltp)
+            return order["orderid"]
+
+    def order_cancel(self, **kwargs):
+        with self._lock:
+            order = self._orders[_first(kwargs, "order_id", "orderid")]
+            if order["status"] not in ["open", "trigger pending"]:
+                raise ValueError(f"cannot cancel {order['status']} order")
+            order.update(status="cancelled", updatetime=self._stamp())
+            self._pending.get(order["symboltoken"], {}).pop(order["orderid"], None)
+            return order["orderid"]
+
+    @property
+    def orders(self):
+        with self._lock:
+            return dict(status=True, data=[dict(o) for o in self._orders.values()])
+
+    @property
+    def positions(self):
+        with self._lock:
+            data = []
+            for token, pos in self._positions.items():
+                ltp = self.ltp.get(token, 0)
+                data.append(
+                    dict(
+                        tradingsymbol=pos["tradingsymbol"],
+                        symboltoken=token,
+                        exchange=pos["exchange"],
+                        producttype=pos["producttype"],
+                        netqty=str(pos["qty"]),
+                        pnl=round(pos["cash"] + pos["qty"] * ltp, 2),
+                    )
+                )
+            return dict(status=True, data=data)
+
+    def pnl(self) -> dict:
+        """pnl by symbol marked at the last price"""
+        return {
+            pos["tradingsymbol"]: float(pos["pnl"]) for pos in self.positions["data"]
+        }
+
+
+def _interval_seconds(interval: str) -> int:
+    return MINUTES[interval] * 60
+
+
+def _day_open(epoch: int) -> int:
+    hour, minute = [int(x) for x in SESSION_OPEN.split(":")]
+    offset = 19800
+    midnight = (int(epoch) + offset) // 86400 * 86400 - offset
+    return midnight + hour * 3600 + minute * 60
+
+
+if __name__ == "__main__":
+    start = pdlm.datetime(2024, 10, 11, 9, 15, tz=TZ)
+    rows = []
+    for i in range(30):
+        price = 100 + i
+        ts = start.add(minutes=i).to_iso8601_string()
+        rows.append([ts, price, price + 0.5, price - 0.5, price + 0.2, 10])
+    broker = SimBroker({"2885": rows})
+    broker.now = start.add(minutes=16).int_timestamp
+    historic_param = dict(
+        symboltoken="2885",
+        interval="FIFTEEN_MINUTE",
+        fromdate="2024-10-11 09:15",
+        todate="2024-10-11 10:00",
+    )
+    print(broker.obj.getCandleData(historic_param))
+    order_id = broker.order_place(
+        symbol="SBIN-EQ",
+        symboltoken="2885",
+        side="BUY",
+        order_type="STOPLOSS_LIMIT",
+        price=120.1,
+        trigger_price=120.05,
+        quantity=1,
+    )
+    for price in tick_path(119.8, 120.5, 119.5, 120.4):
+        broker.on_tick("2885", price)
+    print(broker.orders["data"][0]["status"], broker.positions["data"])
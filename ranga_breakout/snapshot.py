@@ -0,0 +1,275 @@
+from traceback import print_exc
+import json
+import operator
+import os
+import time
+
+import pendulum as pdlm
+
+from __init__ import logging, S_STOPS, json_default
+from api import Helper
+from orderbook import OrderBook
+
+# plain attributes kept besides dct, whichever the strategy has
+ATTRS = ["dir", "candle_count", "candle_other", "candle_start"]
+# dct entries that are code, rebuilt on restore
+CALLABLES = ["fn", "can_trail"]
+# change on nearly every run, saved but not worth a journal line alone
+VOLATILE = ["last_price", "buy_args", "sell_args", "candle_other"]
+LIVE = ["open", "trigger pending", "complete"]
+# states that send the opening orders, what a crash may have left live
+OPENING = ["place_both_orders", "place_entry"]
+
+
+def state_of(obj) -> dict:
+    """what is needed to rebuild a strategy, without its callables"""
+    fn = obj.dct["fn"]
+    return dict(
+        cls=obj.__class__.__name__,
+        fn=None if fn is None else fn.__name__,
+        dct={k: v for k, v in obj.dct.items() if k not in CALLABLES},
+        attrs={k: getattr(obj, k) for k in ATTRS if hasattr(obj, k)},
+    )
+
+
+def _steady(state: dict) -> str:
+    """the state without its volatile fields, to tell a real change"""
+    return json.dumps(
+        dict(
+            state,
+            dct={k: v for k, v in state["dct"].items() if k not in VOLATILE},
+            attrs={k: v for k, v in state["attrs"].items() if k not in VOLATILE},
+        ),
+        default=json_default,
+    )
+
+
+def _can_trail(obj):
+    """the condition the strategy set when its entry filled"""
+    entry, fn = obj.dct["entry"], obj.dct["fn"]
+    if entry is None:
+        return None
+    is_above = operator.gt if entry == "buy" else operator.lt
+    key = "h" if entry == "buy" else "l"
+    # reverse waits for the two candle extreme before breakeven
+    if obj.__class__.__name__ == "Reverse" and getattr(fn, "__name__", "") == (
+        "move_breakeven"
+    ):
+        key = "candle_two"
+    return lambda c: is_above(c["last_price"], c[key])
+
+
+def restore(state: dict, classes: dict):
+    """rehydrate a strategy without running __init__, so nothing is placed"""
+    cls = classes[state["cls"]]
+    obj = cls.__new__(cls)
+    obj.dct = dict(state["dct"])
+    for k, v in state["attrs"].items():
+        setattr(obj, k, v)
+    obj.dct["fn"] = None if state["fn"] is None else getattr(obj, state["fn"])
+    obj.dct["can_trail"] = _can_trail(obj)
+    obj.dct_of_orders = {}
+    obj.message = "restored from snapshot"
+    if hasattr(cls, "_get_history"):
+        obj.next_check = pdlm.now()
+    return obj
+
+
+class Snapshots:
+    """
+    every change of a strategy is appended to a journal, the journal
+    is folded into a checkpoint once it grows past `compact_after`
+    lines. loading reads the checkpoint and replays the journal.
+    """
+
+    def __init__(self, path=S_STOPS, journal=None, compact_after=500):
+        self.path = path
+        self.journal = path.replace(".json", ".jsonl") if journal is None else journal
+        self.compact_after = compact_after
+        self.lines = 0
+        # latest state and its steady part by trading symbol
+        self._states = {}
+        self._last = {}
+
+    def _write_checkpoint(self, dct_of_states):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                dict(date=pdlm.today().to_date_string(), states=dct_of_states),
+                f,
+                default=json_default,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # the journal is only truncated once the checkpoint is safe
+        open(self.journal, "w").close()
+        self.lines = 0
+
+    def record(self, strategies: list):
+        """journal the strategies whose state changed since last time"""
+        try:
+            lines = []
+            for obj in strategies:
+                state, key = state_of(obj), obj.dct["tsym"]
+                self._states[key] = state
+                steady = _steady(state)
+                if self._last.get(key, None) != steady:
+                    self._last[key] = steady
+                    lines.append(json.dumps(state, default=json_default))
+            if any(lines):
+                with open(self.journal, "a") as f:
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.lines += len(lines)
+            if self.lines > self.compact_after:
+                self.checkpoint()
+        except Exception as e:
+            logging.error(f"{e} while recording snapshots")
+            print_exc()
+
+    def checkpoint(self):
+        self._write_checkpoint(self._states)
+
+    def load(self) -> dict:
+        """today's states by trading symbol, empty on a fresh day"""
+        states = {}
+        try:
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    dct = json.load(f)
+                if dct["date"] == pdlm.today().to_date_string():
+                    states.update(dct["states"])
+            if os.path.exists(self.journal) and pdlm.from_timestamp(
+                os.path.getmtime(self.journal), tz="local"
+            ).is_same_day(pdlm.now()):
+                with open(self.journal) as f:
+                    for line in f:
+                        try:
+                            state = json.loads(line)
+                        except ValueError:
+                            # torn last line of a crash
+                            break
+                        states[state["dct"]["tsym"]] = state
+        except Exception as e:
+            logging.error(f"{e} while loading snapshots")
+            print_exc()
+        finally:
+            self._states = dict(states)
+            self._last = {k: _steady(v) for k, v in states.items()}
+            return states
+
+
+def snapshots_of(entry: str, compact_after=500) -> Snapshots:
+    """
+    snapshots of one entry point, the mains trade different classes
+    and sides and must not restore each other's strategies
+    """
+    return Snapshots(S_STOPS.replace(".json", f"_{entry}.json"), None, compact_after)
+
+
+def _adopt_orders(obj, book: OrderBook) -> bool:
+    """
+    orders of a strategy that crashed after placing but before its
+    state was journaled, found by token and side in the book. a leg
+    that is missing is placed now, or the found legs are cancelled
+    when it cannot be, so no leg is ever sent twice
+    """
+    found = {}
+    for side in obj.legs():
+        found[side] = obj.dct[f"{side}_id"]
+        if found[side] is None:
+            for order in book.orders_for(obj.dct["token"]).values():
+                if (
+                    order.get("transactiontype", "").lower() == side
+                    and order.get("status", None) in LIVE
+                ):
+                    found[side] = order["orderid"]
+    if not any(found.values()):
+        # nothing went in before the crash, the strategy places it all
+        return False
+
+    for side, order_id in found.items():
+        if order_id is None:
+            resp = Helper.order_place(**obj.dct[f"{side}_args"])
+            if not (isinstance(resp, str) and len(resp) > 0):
+                for order_id in filter(None, found.values()):
+                    Helper.order_cancel(order_id=order_id, variety="NORMAL")
+                obj.message = (
+                    f"{obj.dct['tsym']} {side} order failed, adopted legs cancelled"
+                )
+                logging.warning(obj.message)
+                obj.dct["fn"] = None
+                return False
+            found[side] = resp
+    obj.dct.update({f"{side}_id": order_id for side, order_id in found.items()})
+    return True
+
+
+def reconcile(strategies: list, book: OrderBook):
+    """make restored strategies agree with what the broker has"""
+    for obj in strategies:
+        try:
+            fn = getattr(obj.dct["fn"], "__name__", None)
+            if fn in OPENING and _adopt_orders(obj, book):
+                obj.legs_placed()
+                logging.info(f"{obj.dct['tsym']} adopted orders already placed")
+                # a leg placed just now is not in this book yet
+                continue
+            for side in ["buy", "sell"]:
+                order_id = obj.dct[f"{side}_id"]
+                if order_id is not None and book.get(order_id) is None:
+                    logging.warning(f"{obj.dct['tsym']} {side} {order_id} not in book")
+        except Exception as e:
+            logging.error(f"{e} while reconciling {obj.dct['tsym']}")
+            print_exc()
+
+
+def warm_start(classes: list, book: OrderBook, snapshots: Snapshots) -> list:
+    """strategies of today's snapshot reconciled with the order book"""
+    started = time.monotonic()
+    dct_of_classes = {cls.__name__: cls for cls in classes}
+    # strategies that are done have nothing to pick up, a day that
+    # ended normally starts afresh
+    strategies = [
+        restore(state, dct_of_classes)
+        for state in snapshots.load().values()
+        if state["cls"] in dct_of_classes and state["fn"] is not None
+    ]
+    if any(strategies):
+        book.update(Helper.orders)
+        reconcile(strategies, book)
+        logging.info(
+            f"warm start of {len(strategies)} strategies "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+    return strategies
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    class Fake:
+        def __init__(self, tsym):
+            self.dct = dict(tsym=tsym, token="1", entry="buy", h=10, l=5)
+            self.dct["fn"] = self.trail_stoploss
+            self.dct["can_trail"] = None
+            self.dct["last_price"] = 11
+            self.candle_count = 3
+
+        def trail_stoploss(self):
+            pass
+
+    folder = tempfile.mkdtemp()
+    snapshots = Snapshots(folder + "/stops.json", folder + "/stops.jsonl", 3)
+    objs = [Fake(f"SYM{i}") for i in range(3)]
+    snapshots.record(objs)
+    objs[0].dct["l"] = 7
+    snapshots.record(objs)
+    objs[1].dct["last_price"] = 12
+    snapshots.record(objs)
+    print(f"{snapshots.lines} journal lines")
+    states = Snapshots(folder + "/stops.json", folder + "/stops.jsonl").load()
+    obj = restore(states["SYM0"], {"Fake": Fake})
+    print(obj.dct, obj.dct["fn"], obj.dct["can_trail"](obj.dct))
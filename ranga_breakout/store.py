@@ -0,0 +1,242 @@
+from traceback import print_exc
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pendulum as pdlm
+
+from __init__ import logging, S_DATA, S_OUT, TZ
+from history import Candles, get_historical_many
+
+S_STORE = S_DATA + "store/"
+COLUMNS = ["ts", "o", "h", "l", "c", "v"]
+INDEX = np.dtype(
+    [
+        ("day", "i4"),
+        ("token", "U16"),
+        ("first", "i8"),
+        ("end", "i8"),
+        # rows of the day and where they start in its file
+        ("rows", "i8"),
+        ("offset", "i8"),
+        # a rewrite of a day goes to a new file, 0 is the first
+        ("version", "i4"),
+    ]
+)
+ITEM = 8
+
+
+def _day_int(day) -> int:
+    """20241011 from "2024-10-11", a date or a datetime"""
+    return int(pdlm.parse(str(day)[:10]).format("YYYYMMDD"))
+
+
+def _day_str(day_int: int) -> str:
+    day = str(day_int)
+    return f"{day[:4]}-{day[4:6]}-{day[6:]}"
+
+
+def _candles(block: np.ndarray) -> Candles:
+    """(6, n) float64 block to Candles, epochs are exact in a float64"""
+    return Candles(block[0].astype(np.int64), *block[1:])
+
+
+class CandleStore:
+    """
+    candles of one interval on disk, a file per day holding every
+    token of the day back to back as a (6, rows) float64 array, so each
+    column is contiguous. index.npy has (day, token, first row, end
+    row) of every token of every day, a range query opens only the days
+    it needs and reads just the rows of the token. a day is written
+    once after the close, never in place, a rewrite goes to a file of
+    its own and the index is switched over before the old one goes.
+    """
+
+    def __init__(self, root=S_STORE, interval="ONE_MINUTE"):
+        self.folder = os.path.join(root, interval)
+        self.interval = interval
+        self._index = None
+        self._maps = {}
+
+    def _path(self, day_int: int, version: int) -> str:
+        day = _day_str(day_int)
+        name = f"{day}.npy" if version == 0 else f"{day}.{version}.npy"
+        return os.path.join(self.folder, day[:4], name)
+
+    """
+        index
+    """
+
+    @property
+    def index(self) -> np.ndarray:
+        if self._index is None:
+            try:
+                index = np.load(os.path.join(self.folder, "index.npy"))
+                # an index from before versions points at version 0
+                self._index = np.zeros(len(index), dtype=INDEX)
+                for name in index.dtype.names:
+                    self._index[name] = index[name]
+            except FileNotFoundError:
+                self._index = np.empty(0, dtype=INDEX)
+        return self._index
+
+    def _save_index(self, index: np.ndarray):
+        index = np.sort(index, order=["day", "token"])
+        tmp = os.path.join(self.folder, "index.tmp.npy")
+        np.save(tmp, index)
+        os.replace(tmp, os.path.join(self.folder, "index.npy"))
+        self._index = index
+
+    def days(self) -> list:
+        return [_day_str(day) for day in np.unique(self.index["day"])]
+
+    def tokens(self) -> list:
+        return np.unique(self.index["token"]).tolist()
+
+    """
+        write
+    """
+
+    def write_day(self, day, dct_of_candles: dict) -> int:
+        """
+        candles of one day by token, rows as the broker sends them or
+        Candles. replaces the day if it was written before
+        """
+        day_int = _day_int(day)
+        blocks, rows = [], []
+        for token in sorted(dct_of_candles, key=str):
+            candles = Candles.from_rows(dct_of_candles[token])
+            if len(candles) == 0:
+                continue
+            order = np.argsort(candles.ts, kind="stable")
+            blocks.append(np.array([getattr(candles, col)[order] for col in COLUMNS]))
+            first = rows[-1][3] if any(rows) else 0
+            rows.append([day_int, str(token), first, first + len(candles)])
+        if not any(rows):
+            return 0
+        old = np.unique(self.index["version"][self.index["day"] == day_int])
+        version = int(old.max()) + 1 if len(old) > 0 else 0
+        path = self._path(day_int, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp.npy"
+        np.save(tmp, np.concatenate(blocks, axis=1).astype(np.float64))
+        offset = np.load(tmp, mmap_mode="r").offset
+        os.replace(tmp, path)
+        total = rows[-1][3]
+        rows = [tuple(row + [total, offset, version]) for row in rows]
+        index = self.index[self.index["day"] != day_int]
+        # a crash before this leaves the old day whole, after it the new
+        self._save_index(np.concatenate([index, np.array(rows, dtype=INDEX)]))
+        self._maps.pop(day_int, None)
+        # older files of the day, and any a crash left behind
+        folder, name = os.path.split(path)
+        for stale in os.listdir(folder):
+            if stale.startswith(_day_str(day_int) + ".") and stale != name:
+                try:
+                    os.remove(os.path.join(folder, stale))
+                except OSError as e:
+                    logging.warning(f"{e} while removing a replaced day")
+        return total
+
+    """
+        read
+    """
+
+    def day(self, day) -> dict:
+        """Candles by token of one day, the prices are views of the mapped file"""
+        day_int = _day_int(day)
+        rows = self.index[self.index["day"] == day_int]
+        if len(rows) == 0:
+            return {}
+        if day_int not in self._maps:
+            path = self._path(day_int, int(rows["version"][0]))
+            self._maps[day_int] = np.load(path, mmap_mode="r")
+        block = self._maps[day_int]
+        return {
+            str(row["token"]): _candles(block[:, row["first"] : row["end"]])
+            for row in rows
+        }
+
+    def _read(self, rows: np.ndarray) -> np.ndarray:
+        """rows of the index into one (6, n) block, one open per day"""
+        sizes = rows["end"] - rows["first"]
+        block = np.empty((len(COLUMNS), int(sizes.sum())))
+        at = 0
+        for row, size in zip(rows, sizes):
+            path = self._path(int(row["day"]), int(row["version"]))
+            with open(path, "rb") as f:
+                for col in range(len(COLUMNS)):
+                    f.seek(row["offset"] + (col * row["rows"] + row["first"]) * ITEM)
+                    f.readinto(memoryview(block[col, at : at + size]))
+            at += size
+        return block
+
+    def query(self, token, start="", end="") -> Candles:
+        """
+        candles of a token from start to end, inclusive. either may be a
+        day or a time, "2024-10-11" or "2024-10-11 10:00", empty for all
+        """
+        index = self.index
+        rows = index[index["token"] == str(token)]
+        if start:
+            rows = rows[rows["day"] >= _day_int(start)]
+        if end:
+            rows = rows[rows["day"] <= _day_int(end)]
+        block = self._read(rows)
+        keep = np.ones(block.shape[1], dtype=bool)
+        if start:
+            keep &= block[0] >= pdlm.parse(str(start), tz=TZ).int_timestamp
+        if end:
+            upto = pdlm.parse(str(end), tz=TZ)
+            upto = upto.end_of("day") if len(str(end)) <= 10 else upto
+            keep &= block[0] <= upto.int_timestamp
+        return _candles(block if keep.all() else block[:, keep])
+
+
+O_STORE = CandleStore()
+
+
+def _ingest_param(row, day: str, interval: str) -> dict:
+    return {
+        "exchange": row["exchange"],
+        "symboltoken": str(row["token"]),
+        "interval": interval,
+        "fromdate": f"{day} 09:15",
+        "todate": f"{day} 15:30",
+    }
+
+
+def ingest(day="", universe=None, store=O_STORE) -> dict:
+    """
+    download the bars of every token of the universe for the day and
+    add them to the store, run after the close. universe defaults to
+    the last stocks_in_play
+    """
+    started = time.perf_counter()
+    stats = dict(day="", tokens=0, rows=0, errors=0, seconds=0.0)
+    try:
+        day = day or pdlm.today(tz=TZ).to_date_string()
+        if universe is None:
+            universe = pd.read_csv(S_OUT)
+        params = {
+            str(row["token"]): _ingest_param(row, day, store.interval)
+            for _, row in universe.iterrows()
+        }
+        resp, errors = get_historical_many(params)
+        rows = store.write_day(day, resp)
+        stats.update(day=day, tokens=len(resp), rows=rows, errors=len(errors))
+    except Exception as e:
+        logging.error(f"{e} while ingesting candles")
+        print_exc()
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    logging.info(f"ingest {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python3 store.py [YYYY-MM-DD ...] after the close, today by default
+    for day in sys.argv[1:] or [""]:
+        ingest(day)
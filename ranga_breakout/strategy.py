@@ -1,12 +1,13 @@
 from traceback import print_exc
 from typing import Any  # Importing only the required types
 
-from toolkit.kokoo import dt_to_str
-
 from __init__ import logging
 from api import Helper
+from orderbook import OrderBook
 
-from history import find_buy_stop, get_historical_data, find_sell_stop
+from history import find_buy_stop, find_sell_stop
+from candles import O_CANDLES, candle_interval
+from latency import timed
 
 from pprint import pprint
 
@@ -82,7 +83,7 @@ class Breakout:
 
     def _buy_trade(self, args):
         # Place buy order
-        resp = Helper.api.order_place(**args["buy_args"])
+        resp = Helper.order_place(**args["buy_args"])
         logging.debug(
             f"{args['buy_args']['symbol']} {args['buy_args']['side']} got {resp=}"
         )
@@ -91,7 +92,7 @@ class Breakout:
 
     def _sell_trade(self, args):
         # Place sell order
-        resp = Helper.api.order_place(**args["sell_args"])
+        resp = Helper.order_place(**args["sell_args"])
         logging.debug(
             f"{args['sell_args']['symbol']} {args['sell_args']['side']} got {resp=}"
         )
@@ -116,6 +117,7 @@ class Breakout:
         buy_or_sell = self.dct[f"{operation}_id"]
         return self.dct_of_orders[buy_or_sell]["status"]
 
+    @timed()
     def is_buy_or_sell(self):
         """
         determine if buy or sell order is completed
@@ -164,14 +166,9 @@ class Breakout:
             print_exc()
 
     def get_history(self):
-        params = {
-            "exchange": self.dct["exchange"],
-            "symboltoken": self.dct["token"],
-            "interval": "FIFTEEN_MINUTE",
-            "fromdate": dt_to_str("9:15"),
-            "todate": dt_to_str(""),
-        }
-        return get_historical_data(params)
+        return O_CANDLES.get(
+            self.dct["exchange"], self.dct["token"], candle_interval()
+        )
 
     def _is_modify_order(self, candles_now):
         try:
@@ -214,6 +211,7 @@ class Breakout:
             logging.error(self.message)
             print_exc()
 
+    @timed()
     def trail_stoploss(self):
         """
         if candles  count is changed and then check ltp
@@ -261,7 +259,7 @@ class Breakout:
                     """
                     if any(args):
                         logging.debug(f"order modify {args}")
-                        resp = Helper.api.order_modify(**args)
+                        resp = Helper.order_modify(**args)
                         logging.debug(f"order modify {resp}")
                         self.candle_count = len(candles_now)
                         self.candle_other = len(candles_now)
@@ -273,12 +271,15 @@ class Breakout:
             logging.error(self.message)
             print_exc()
 
+    @timed()
     def run(self, lst_of_orders, dct_of_ltp, CANDLE_OTHER):
         try:
             if isinstance(lst_of_orders, list):
                 self.dct_of_orders = {
                     dct["orderid"]: dct for dct in lst_of_orders if "orderid" in dct
                 }
+            elif isinstance(lst_of_orders, OrderBook):
+                self.dct_of_orders = lst_of_orders.by_id
             self.dct["last_price"] = dct_of_ltp.get(
                 self.dct["token"], self.dct["last_price"]
             )
@@ -308,7 +309,7 @@ class Breakout:
 
 
 if __name__ == "__main__":
-    from main import get_ltp
+    from market import get_ltp
     from universe import stocks_in_play
     from history import get_candles
 
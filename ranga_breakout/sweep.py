@@ -0,0 +1,137 @@
+from traceback import print_exc
+from contextlib import contextmanager
+from multiprocessing import Pool
+import itertools
+import time
+
+import pandas as pd
+
+from __init__ import logging, O_SETG, S_OUT
+from history import get_candles, get_candles_ranked
+from store import O_STORE
+
+# where each sweep axis lives in settings
+AXES = {
+    "distance": ("reverse", "distance"),
+    "lookback": ("stop_lookback",),
+    "minutes": ("candle_minutes",),
+}
+_MISSING = object()
+
+
+@contextmanager
+def settings(params: dict):
+    """
+    O_SETG with the params of one task, put back as it was afterwards
+    so a worker does not carry them into its next task
+    """
+    saved = []
+    try:
+        for key, value in params.items():
+            *parents, leaf = AXES[key]
+            dct = O_SETG
+            for parent in parents:
+                dct = dct[parent]
+            saved.append((dct, leaf, dct.get(leaf, _MISSING)))
+            dct[leaf] = value
+        yield
+    finally:
+        for dct, leaf, value in reversed(saved):
+            if value is _MISSING:
+                dct.pop(leaf, None)
+            else:
+                dct[leaf] = value
+
+
+def grid(**axes) -> list:
+    """every combination of the axes, e.g. grid(distance=[0.5, 1])"""
+    keys = list(axes)
+    return [dict(zip(keys, v)) for v in itertools.product(*axes.values())]
+
+
+_STORE, _UNIVERSE = None, None
+
+
+def _open(store, universe):
+    global _STORE, _UNIVERSE
+    _STORE, _UNIVERSE = store, universe
+
+
+def _run(task) -> dict:
+    """one parameter set on one day, in a worker process"""
+    from backtest import Backtest
+    from breakout import Breakout
+    from reverse import Reverse
+
+    strategies = {
+        "Reverse": (Reverse, get_candles),
+        "Breakout": (Breakout, get_candles_ranked),
+    }
+    name, params, day = task
+    result = dict(params, day=day, pnl=0.0, trades=0)
+    try:
+        make, get_params = strategies[name]
+        # views into the mapped day file, nothing is unpickled
+        minutes = _STORE.day(day)
+        universe = _UNIVERSE[_UNIVERSE["token"].isin(minutes)]
+        with settings(params):
+            resp = Backtest(minutes, universe, make, get_params).run()
+        result.update(pnl=resp["pnl"], trades=resp["trades"])
+    except Exception as e:
+        logging.error(f"{e} while sweeping {params}")
+        print_exc()
+    return result
+
+
+def _drawdown(pnl: pd.Series) -> float:
+    equity = pnl.cumsum()
+    return float((equity.cummax().clip(lower=0) - equity).max())
+
+
+def sweep(
+    name: str, lst_of_params: list, universe=None, store=O_STORE, processes=None
+):
+    """
+    backtest `name` with every parameter set over every day of the
+    candle store on a pool of processes, returns one row per parameter
+    set. universe defaults to the last stocks_in_play
+    """
+    started = time.perf_counter()
+    if universe is None:
+        universe = pd.read_csv(S_OUT)
+    universe = universe.assign(token=universe["token"].astype(str))
+    days = store.days()
+    tasks = [(name, params, day) for params in lst_of_params for day in days]
+    with Pool(processes, initializer=_open, initargs=(store, universe)) as pool:
+        results = list(pool.imap_unordered(_run, tasks))
+    df = pd.DataFrame(results).sort_values("day")
+    keys = list(lst_of_params[0])
+    report = df.groupby(keys).agg(
+        pnl=("pnl", "sum"),
+        trades=("trades", "sum"),
+        days=("day", "count"),
+        win_days=("pnl", lambda pnl: int((pnl > 0).sum())),
+        max_drawdown=("pnl", _drawdown),
+    )
+    logging.info(
+        f"swept {len(lst_of_params)} sets over {len(days)} days "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return report.sort_values("pnl", ascending=False).reset_index()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from simbroker import random_day
+    from store import CandleStore
+
+    tokens = [str(1000 + i) for i in range(20)]
+    universe = pd.DataFrame(
+        dict(symbol=[f"SYM{t}-EQ" for t in tokens], exchange="NSE", token=tokens)
+    ).assign(quantity=1)
+    store = CandleStore(tempfile.mkdtemp())
+    for day in range(7, 12):
+        day = f"2024-10-{day:02d}"
+        store.write_day(day, random_day(tokens, day, seed=int(day[-2:])))
+    lst_of_params = grid(distance=[0, 0.1], lookback=[2, 3], minutes=[5, 15])
+    print(sweep("Reverse", lst_of_params, universe, store))
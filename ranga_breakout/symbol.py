@@ -1,50 +1,211 @@
-from __init__ import O_FUTL, S_DUMP, logging
+from __init__ import O_FUTL, S_DUMP, S_SYMS, logging
 from requests import get
+import numpy as np
+import codecs
+import json
+import os
+
+URL = "https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json"
+HEADERS = {
+    "Host": "angelbroking.com",
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:68.0) Gecko/20100101 Firefox/68.0",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1"
+}
+# columns kept in the compact cache, in the order they are written
+COLUMNS = ["symbol", "exch_seg", "lotsize", "tick_size", "token"]
+# segments we trade, everything else is dropped while parsing
+SEGMENTS = ["NSE", "NFO"]
+CHUNK_SIZE = 1024 * 1024
+
+
+def stream_records(chunks, segments=SEGMENTS):
+    """
+    parse a json array of records from an iterable of byte chunks,
+    yielding only the columns we keep for the given segments
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    buf = ""
+    for chunk in chunks:
+        buf += decoder.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,[":
+                pos += 1
+            if pos >= len(buf) or buf[pos] == "]":
+                break
+            try:
+                obj, pos_end = json_decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # record is split across chunks, wait for the next one
+                break
+            pos = pos_end
+            if obj.get("exch_seg") in segments:
+                yield {col: obj.get(col, "") for col in COLUMNS}
+        buf = buf[pos:]
+    # anything but the closing bracket left over was never parsed
+    rest = (buf + decoder.decode(b"", final=True)).strip(" \t\r\n,]")
+    if rest:
+        raise ValueError(f"malformed json near {rest[:80]!r}")
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def download(url, path, segments=SEGMENTS):
+    """
+    stream the master into path through a temp file and atomic rename,
+    parsing records on the way so the body is never held in memory
+    """
+    tmp = path + ".tmp"
+    try:
+        with get(url, headers=HEADERS, stream=True, timeout=60) as resp:
+            if resp.status_code != 200:
+                raise Exception(f"no response from angel masters {resp.status_code}")
+            with open(tmp, "wb") as f:
+
+                def tee():
+                    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+                        yield chunk
+
+                lst = list(stream_records(tee(), segments))
+        if not any(lst):
+            raise Exception(f"no records from angel masters {url}")
+        os.replace(tmp, path)
+        return lst
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
 
 class Symbol:
 
-    def __init__(self):
+    def __init__(self, url=URL):
+        self._url = url
         self._data = self.data
+        self._tokens, self._records = self._build_index(self._data)
 
     @property
     def data(self):
+        if not O_FUTL.is_file_not_2day(S_SYMS + "token.npy"):
+            cols = self._load_cache()
+            if any(cols):
+                return cols
+        records, is_fresh = self._get_records()
+        cols = self._to_columns(records)
+        # a cache dated today must never hold an old master
+        if is_fresh:
+            self._save_cache(cols)
+        return cols
+
+    def _get_records(self):
+        """records of the master, and whether they are today's"""
         try:
             if O_FUTL.is_file_not_2day(S_DUMP):
-                headers = {
-                    "Host": "angelbroking.com",
-                    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:68.0) Gecko/20100101 Firefox/68.0",
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                    "Accept-Language": "en-US,en;q=0.5",
-                    "Accept-Encoding": "gzip, deflate, br",
-                    "Connection": "keep-alive",
-                    "Upgrade-Insecure-Requests": "1"
-                }
-                url = "https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json"
-                resp = get(url, headers=headers)
-                # if resp is 200 then
-                if resp.status_code == 200:
-                    if resp.text is None or len(resp.text) < 100:
-                        logging.error(
-                            f"no response from angel masters {resp.text}")
-                    else:
-                        with open(S_DUMP, "w") as json_file:
-                            json_file.write(resp.text)
+                return download(self._url, S_DUMP), True
+        except Exception as e:
+            logging.error(f"{e} while downloading symbols")
+        is_fresh = not O_FUTL.is_file_not_2day(S_DUMP)
+        if not is_fresh:
+            logging.warning(f"degraded run, symbols from the last good {S_DUMP}")
+        try:
+            return list(stream_records(read_chunks(S_DUMP))), is_fresh
+        except Exception as e:
+            logging.error(f"{e} while reading {S_DUMP}")
+            return [], False
+
+    def _to_columns(self, data):
+        """
+        turn the list of master records into one numpy array per column
+        """
+        try:
+            cols = {}
+            if not any(data):
+                return cols
+            for col in COLUMNS:
+                lst = [i.get(col, "") for i in data]
+                if col in ["lotsize", "tick_size"]:
+                    cols[col] = np.array(
+                        [float(v) if v not in ["", None] else 0.0 for v in lst],
+                        dtype=np.float64,
+                    )
                 else:
-                    raise Exception(
-                        f"no response from angel masters {resp.status_code}")
+                    cols[col] = np.array(lst, dtype=str)
+        except Exception as e:
+            logging.error(f"{e} while converting symbols to columns")
+            cols = {}
+        finally:
+            return cols
 
+    def _save_cache(self, cols):
+        """
+        token.npy is written last, its date marks the cache as complete
+        """
+        try:
+            if not any(cols):
+                return
+            os.makedirs(S_SYMS, exist_ok=True)
+            for col in COLUMNS:
+                np.save(S_SYMS + col + ".npy", cols[col])
         except Exception as e:
-            print(e)
+            logging.error(f"{e} while saving symbols cache")
+
+    def _load_cache(self):
+        try:
+            return {
+                col: np.load(S_SYMS + col + ".npy", mmap_mode="r") for col in COLUMNS
+            }
+        except Exception as e:
+            logging.warning(f"{e} while loading symbols cache")
+            return {}
+
+    def _build_index(self, cols):
+        """
+        build lookup tables once per load so that every
+        resolution afterwards is a dict hit instead of a scan
+        """
+        tokens, records = {}, {}
+        try:
+            token = cols["token"].tolist()
+            exch_seg = cols["exch_seg"].tolist()
+            # the first row of a repeated key wins, as the old scan did
+            for key, tkn in zip(zip(cols["symbol"].tolist(), exch_seg), token):
+                tokens.setdefault(key, tkn)
+            # row number of the record, materialised on demand
+            for idx, key in enumerate(zip(token, exch_seg)):
+                records.setdefault(key, idx)
+        except Exception as e:
+            logging.error(f"{e} while indexing symbols")
         finally:
-            return O_FUTL.read_file(S_DUMP)
+            return tokens, records
 
     def get_tkn_fm_sym(self, sym, exch):
-        for i in self._data:
-            if (i['symbol'] == sym) and (i['exch_seg'] == exch):
-                return i['token']
-        logging.error(f"token not found for {sym=} {exch=}")
-        return "0"
+        tkn = self._tokens.get((sym, exch), None)
+        if tkn is None:
+            logging.error(f"token not found for {sym=} {exch=}")
+            return "0"
+        return tkn
+
+    def get_tkns_fm_syms(self, lst_of_sym_exch):
+        """
+        resolve many (symbol, exchange) pairs in one go,
+        unresolved pairs get "0" like get_tkn_fm_sym
+        """
+        return [self.get_tkn_fm_sym(sym, exch) for sym, exch in lst_of_sym_exch]
+
+    def get_rec_fm_tkn(self, tkn, exch):
+        idx = self._records.get((str(tkn), exch), None)
+        if idx is None:
+            return {}
+        return {col: self._data[col][idx].item() for col in COLUMNS}
 
 
 if __name__ == "__main__":
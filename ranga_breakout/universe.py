@@ -9,12 +9,8 @@ def stocks_in_play(is_cash=False):
         O_SYM = Symbol()
         S_UNIV = S_CASH if is_cash else S_FUTURE
         df = pd.read_csv(S_UNIV).dropna(axis=0).drop(["enable"], axis=1)
-        for index, row in df.iterrows():
-            exch = row["exchange"]
-            symbol = row["symbol"].replace(" ", "").upper()
-            tkn = O_SYM.get_tkn_fm_sym(symbol, exch)
-            df.loc[index, "token"] = tkn
-            df.loc[index, "symbol"] = symbol
+        df["symbol"] = df["symbol"].str.replace(" ", "").str.upper()
+        df["token"] = O_SYM.get_tkns_fm_syms(zip(df["symbol"], df["exchange"]))
         df = df[df["token"] != "0"]
         df.to_csv(S_OUT, index=False)
         print(df)